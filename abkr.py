@@ -19,8 +19,9 @@ def main():
     '''
         Main function
         Opens a command line interface to the Database Manager
+        --legacy uses the old protocol, one connection per command
     '''
-    interface = cli.CLI()
+    interface = cli.CLI(legacy='--legacy' in sys.argv[1:])
     interface.run()
 
 
@@ -0,0 +1,523 @@
+'''
+    Bitmap indexes, for the BIT columns and the columns with few values
+    The rows of a table get ordinal positions, in the order they are first
+    indexed, kept in <db>/<table>.positions. The index of a column keeps a
+    roaring bitmap of the positions of the rows of every value, in
+    <db>/<table>.<column>.bitmap, the changes done since it was written are
+    appended to the .log next to it. The conditions of the bitmap indexed
+    columns of a SELECT are computed on the bitmaps, a range of values is
+    the OR of their bitmaps, the columns are ANDed, only the positions left
+    are turned into ids
+'''
+
+import os
+import struct
+import threading
+from bisect import bisect_left, bisect_right, insort
+
+import datatypes
+import predicate
+import wire
+from type_def import Types
+
+# a container keeps the low 16 bits of the positions having the same high bits
+CONTAINER_BITS = 16
+CONTAINER_BYTES = (1 << CONTAINER_BITS) // 8
+# an array container having more positions becomes a bitset
+ARRAY_MAX = 4096
+# changes logged before the bitmaps are written again
+MERGE_SIZE = 10000
+
+BATCH_SIZE = 1000
+PROGRESS_EVERY = 10000
+
+CONTAINER = struct.Struct("!HBI")
+ARRAY = 0
+BITSET = 1
+
+SET = 1
+CLEAR = 2
+
+
+def _bitset(array: list) -> int:
+    bits = bytearray(CONTAINER_BYTES)
+    for low in array:
+        bits[low >> 3] |= 1 << (low & 7)
+    return int.from_bytes(bits, "little")
+
+
+def _array(bitset: int) -> list:
+    array = []
+    for i, byte in enumerate(bitset.to_bytes(CONTAINER_BYTES, "little")):
+        if byte:
+            array += [(i << 3) + bit for bit in range(8) if byte >> bit & 1]
+    return array
+
+
+def _smallest(bitset: int):
+    '''
+        An array container for a bitset with few positions
+    '''
+    return _array(bitset) if bitset.bit_count() <= ARRAY_MAX else bitset
+
+
+def _and(a, b):
+    if isinstance(a, int) and isinstance(b, int):
+        return _smallest(a & b)
+    if isinstance(a, int):
+        a, b = b, a
+    if isinstance(b, int):
+        return [low for low in a if b >> low & 1]
+    return sorted(set(a).intersection(b))
+
+
+def _or(a, b):
+    if isinstance(a, int) or isinstance(b, int):
+        a = a if isinstance(a, int) else _bitset(a)
+        b = b if isinstance(b, int) else _bitset(b)
+        return a | b
+    union = sorted(set(a).union(b))
+    return _bitset(union) if len(union) > ARRAY_MAX else union
+
+
+class Bitmap:
+    '''
+        Roaring bitmap of positions, split by their high bits into containers,
+        a container is the sorted list of the low bits while it has at most
+        ARRAY_MAX of them, a 65536 bit integer after
+    '''
+
+    __slots__ = ('containers',)
+
+    def __init__(self, containers: dict = None):
+        self.containers = containers if containers is not None else {}
+
+    def add(self, position: int):
+        high, low = position >> CONTAINER_BITS, position & 0xFFFF
+        container = self.containers.get(high)
+        if container is None:
+            self.containers[high] = [low]
+        elif isinstance(container, int):
+            self.containers[high] = container | (1 << low)
+        else:
+            i = bisect_left(container, low)
+            if i == len(container) or container[i] != low:
+                container.insert(i, low)
+                if len(container) > ARRAY_MAX:
+                    self.containers[high] = _bitset(container)
+
+    def discard(self, position: int):
+        high, low = position >> CONTAINER_BITS, position & 0xFFFF
+        container = self.containers.get(high)
+        if container is None:
+            return
+        if isinstance(container, int):
+            container = _smallest(container & ~(1 << low))
+            self.containers[high] = container
+        else:
+            i = bisect_left(container, low)
+            if i < len(container) and container[i] == low:
+                del container[i]
+        if not container:
+            del self.containers[high]
+
+    def __contains__(self, position: int) -> bool:
+        container = self.containers.get(position >> CONTAINER_BITS)
+        low = position & 0xFFFF
+        if container is None:
+            return False
+        if isinstance(container, int):
+            return bool(container >> low & 1)
+        i = bisect_left(container, low)
+        return i < len(container) and container[i] == low
+
+    def __len__(self) -> int:
+        return sum(container.bit_count() if isinstance(container, int) else len(container)
+                   for container in self.containers.values())
+
+    def __iter__(self):
+        for high in sorted(self.containers):
+            container = self.containers[high]
+            for low in (_array(container) if isinstance(container, int) else container):
+                yield high << CONTAINER_BITS | low
+
+    def __and__(self, other):
+        containers = {}
+        for high in self.containers.keys() & other.containers.keys():
+            container = _and(self.containers[high], other.containers[high])
+            if container:
+                containers[high] = container
+        return Bitmap(containers)
+
+    def __or__(self, other):
+        containers = {high: container if isinstance(container, int) else list(container)
+                      for high, container in self.containers.items()}
+        for high, container in other.containers.items():
+            mine = containers.get(high)
+            if mine is None:
+                containers[high] = container if isinstance(container, int) else list(container)
+            else:
+                containers[high] = _or(mine, container)
+        return Bitmap(containers)
+
+    def to_bytes(self) -> bytes:
+        out = bytearray()
+        for high in sorted(self.containers):
+            container = self.containers[high]
+            if isinstance(container, int):
+                out += CONTAINER.pack(high, BITSET, CONTAINER_BYTES)
+                out += container.to_bytes(CONTAINER_BYTES, "little")
+            else:
+                out += CONTAINER.pack(high, ARRAY, len(container))
+                out += struct.pack("!%dH" % len(container), *container)
+        return bytes(out)
+
+    @staticmethod
+    def from_bytes(data: bytes):
+        containers = {}
+        offset = 0
+        while offset < len(data):
+            high, kind, size = CONTAINER.unpack_from(data, offset)
+            offset += CONTAINER.size
+            if kind == BITSET:
+                containers[high] = int.from_bytes(data[offset:offset + size], "little")
+                offset += size
+            else:
+                containers[high] = list(struct.unpack_from("!%dH" % size, data, offset))
+                offset += 2 * size
+        return Bitmap(containers)
+
+
+class Positions:
+    '''
+        The ordinal positions of the rows of a table, a row keeps its
+        position after it's deleted, so a new row with the same id gets it back
+    '''
+
+    def __init__(self, path: str):
+        self.path = path
+        self.ids = []
+        self.of = {}
+        self.__file = None
+        self.__lock = threading.Lock()
+        for id in wire.records(path):
+            self.of[id] = len(self.ids)
+            self.ids.append(id)
+
+    def assign(self, ids: list) -> list:
+        '''
+            The positions of the ids, the new ids get the next ones
+        '''
+        with self.__lock:
+            new = [id for id in dict.fromkeys(ids) if id not in self.of]
+            if new:
+                if self.__file is None:
+                    self.__file = open(self.path, "ab")
+                self.__file.write(b"".join(wire.record(id) for id in new))
+                self.__file.flush()
+                for id in new:
+                    self.of[id] = len(self.ids)
+                    self.ids.append(id)
+            return [self.of[id] for id in ids]
+
+    def sync(self):
+        with self.__lock:
+            if self.__file is not None:
+                os.fsync(self.__file.fileno())
+
+    def close(self):
+        with self.__lock:
+            if self.__file is not None:
+                self.__file.close()
+                self.__file = None
+
+
+class BitmapIndex:
+    '''
+        value -> Bitmap of the positions of its rows, values in order
+    '''
+
+    def __init__(self, path: str, positions: Positions):
+        self.path = path
+        self.positions = positions
+        self.bitmaps = {}
+        self.values = []
+        self.changes = 0
+        self.__log = None
+        self.__lock = threading.RLock()
+        for value, data in self.__read():
+            self.bitmaps[value] = Bitmap.from_bytes(data)
+        self.values = sorted(self.bitmaps)
+        for operation, value, position in wire.records(path + ".log"):
+            self.__change(operation, value, position)
+
+    # files
+
+    def __read(self):
+        '''
+            (value, bitmap bytes) of the file, every one prefixed with its length
+        '''
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb") as f:
+            data = f.read()
+        offset = 0
+        while offset < len(data):
+            length, = wire.LENGTH.unpack_from(data, offset)
+            value = wire.decode(data[offset + wire.LENGTH.size:offset + wire.LENGTH.size + length])
+            offset += wire.LENGTH.size + length
+            length, = wire.LENGTH.unpack_from(data, offset)
+            offset += wire.LENGTH.size
+            yield value, data[offset:offset + length]
+            offset += length
+
+    def __write(self):
+        '''
+            Writes the bitmaps, then empties the log
+        '''
+        temporary = self.path + ".tmp"
+        with open(temporary, "wb") as f:
+            for value in self.values:
+                data = self.bitmaps[value].to_bytes()
+                f.write(wire.record(value) + wire.LENGTH.pack(len(data)) + data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, self.path)
+        if self.__log is not None:
+            self.__log.close()
+        self.__log = open(self.path + ".log", "wb")
+        self.changes = 0
+
+    def __write_log(self, records: list):
+        if self.__log is None:
+            self.__log = open(self.path + ".log", "ab")
+        self.__log.write(b"".join(wire.record(record) for record in records))
+        self.__log.flush()
+        if self.changes >= MERGE_SIZE:
+            self.__write()
+
+    def __change(self, operation: int, value, position: int):
+        bitmap = self.bitmaps.get(value)
+        if operation == SET:
+            if bitmap is None:
+                bitmap = self.bitmaps[value] = Bitmap()
+                insort(self.values, value)
+            bitmap.add(position)
+        elif bitmap is not None:
+            bitmap.discard(position)
+            if not bitmap.containers:
+                del self.bitmaps[value]
+                del self.values[bisect_left(self.values, value)]
+        self.changes += 1
+
+    # writing
+
+    def insert(self, pairs: list):
+        '''
+            pairs are (value, id) of the inserted rows
+        '''
+        positions = self.positions.assign([id for _, id in pairs])
+        records = [[SET, value, position] for (value, _), position in zip(pairs, positions)]
+        with self.__lock:
+            for record in records:
+                self.__change(*record)
+            self.__write_log(records)
+
+    def delete(self, value, id):
+        position = self.positions.of.get(id)
+        if position is None:
+            return
+        with self.__lock:
+            self.__change(CLEAR, value, position)
+            self.__write_log([[CLEAR, value, position]])
+
+    def load(self, pairs: list):
+        '''
+            Bulk load of the (value, id) pairs of the rows
+        '''
+        positions = self.positions.assign([id for _, id in pairs])
+        with self.__lock:
+            for (value, _), position in zip(pairs, positions):
+                self.__change(SET, value, position)
+            self.__write()
+
+    # reading
+
+    def bitmap(self, conditions: list) -> Bitmap:
+        '''
+            OR of the bitmaps of the values matching all the conditions,
+            conditions are (operator, typed value)
+        '''
+        low, high = 0, len(self.values)
+        tests = []
+        with self.__lock:
+            for operator, value in conditions:
+                match operator:
+                    case Types.EQ:
+                        low = max(low, bisect_left(self.values, value))
+                        high = min(high, bisect_right(self.values, value))
+                    case Types.GT:
+                        low = max(low, bisect_right(self.values, value))
+                    case Types.GE:
+                        low = max(low, bisect_left(self.values, value))
+                    case Types.LT:
+                        high = min(high, bisect_left(self.values, value))
+                    case Types.LE:
+                        high = min(high, bisect_right(self.values, value))
+                    case _:
+                        tests.append((predicate.OPERATOR_FUNCTIONS[operator], value))
+            result = Bitmap()
+            for value in self.values[low:high]:
+                if all(test(value, bound) for test, bound in tests):
+                    result = result | self.bitmaps[value]
+            return result
+
+    def ids(self, bitmap: Bitmap) -> list:
+        ids = self.positions.ids
+        return [ids[position] for position in bitmap]
+
+    def select(self, conditions: list) -> set:
+        return set(self.ids(self.bitmap(conditions)))
+
+    def lookup(self, values: list) -> list:
+        result = Bitmap()
+        with self.__lock:
+            for value in set(values):
+                if value in self.bitmaps:
+                    result = result | self.bitmaps[value]
+        return self.ids(result)
+
+    def existing(self, values: list) -> set:
+        with self.__lock:
+            return {value for value in set(values) if value in self.bitmaps}
+
+    def distinct(self) -> int:
+        return len(self.values)
+
+    def postings(self) -> list:
+        '''
+            (value, number of rows) of every value, in order
+        '''
+        with self.__lock:
+            return [(value, len(self.bitmaps[value])) for value in self.values]
+
+    def sync(self):
+        with self.__lock:
+            if self.__log is not None:
+                os.fsync(self.__log.fileno())
+
+    def close(self):
+        with self.__lock:
+            if self.__log is not None:
+                self.__log.close()
+                self.__log = None
+
+    def drop(self):
+        self.close()
+        for path in (self.path, self.path + ".log", self.path + ".tmp"):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def build(index: BitmapIndex, schema, column: str, table, progress=None):
+    '''
+        Loads the index from the rows of the table, which is locked meanwhile,
+        nulls are not indexed
+        progress(done, total) is called every PROGRESS_EVERY rows
+    '''
+    total = table.estimated_document_count()
+    field = schema.field(column)
+    projection = {field: 1} if schema.typed else {"Value": 1}
+    pairs = []
+    done = 0
+    for document in table.find({}, projection).batch_size(BATCH_SIZE):
+        value = datatypes.row(schema, document)[field]
+        if value is not None:
+            pairs.append((value, document["_id"]))
+        done += 1
+        if progress is not None and done % PROGRESS_EVERY == 0:
+            progress(done, total)
+    index.load(pairs)
+    if progress is not None:
+        progress(done, total)
+
+
+class BitmapStore:
+    '''
+        The open bitmap indexes, (db, table, column) -> BitmapIndex,
+        and the positions of the rows of their tables
+    '''
+
+    def __init__(self):
+        self.__indexes = {}
+        self.__positions = {}
+        self.__lock = threading.Lock()
+
+    @staticmethod
+    def path(db: str, table: str, column: str) -> str:
+        return db + '/' + table + '.' + column + '.bitmap'
+
+    def __table_positions(self, db: str, table: str) -> Positions:
+        positions = self.__positions.get((db, table))
+        if positions is None:
+            positions = self.__positions[(db, table)] = Positions(db + '/' + table + '.positions')
+        return positions
+
+    def get(self, db: str, table: str, column: str) -> BitmapIndex:
+        key = (db, table, column)
+        with self.__lock:
+            index = self.__indexes.get(key)
+            if index is None:
+                index = self.__indexes[key] = BitmapIndex(self.path(db, table, column),
+                                                          self.__table_positions(db, table))
+            return index
+
+    def select(self, db: str, table: str, conditions: dict) -> set:
+        '''
+            Ids of the rows matching the conditions of all the columns,
+            conditions maps the columns to their (operator, typed value) list
+        '''
+        if not conditions:
+            return set()
+        result = None
+        index = None
+        for column, column_conditions in conditions.items():
+            index = self.get(db, table, column)
+            bitmap = index.bitmap(column_conditions)
+            result = bitmap if result is None else result & bitmap
+            if not result.containers:
+                return set()
+        # the indexes of the table share the positions of its rows
+        return set(index.ids(result))
+
+    def drop(self, db: str, table: str, column: str):
+        self.get(db, table, column).drop()
+        with self.__lock:
+            del self.__indexes[(db, table, column)]
+
+    def drop_table(self, db: str, table: str):
+        '''
+            Drops the positions, once the bitmap indexes of the table are dropped
+        '''
+        with self.__lock:
+            positions = self.__table_positions(db, table)
+            del self.__positions[(db, table)]
+        positions.close()
+        if os.path.exists(positions.path):
+            os.remove(positions.path)
+
+    def drop_database(self, db: str):
+        with self.__lock:
+            for key in [key for key in self.__indexes if key[0] == db]:
+                self.__indexes.pop(key).close()
+            for key in [key for key in self.__positions if key[0] == db]:
+                self.__positions.pop(key).close()
+
+    def sync(self):
+        with self.__lock:
+            indexes = list(self.__indexes.values())
+            positions = list(self.__positions.values())
+        for index in indexes:
+            index.sync()
+        for table_positions in positions:
+            table_positions.sync()
@@ -0,0 +1,545 @@
+'''
+    B+tree index files, an alternative to the index tables in MongoDB
+    The index of a column is kept in <db>/<table>.<column>.btree and read
+    through mmap. The file has a header, the posting lists (the ids of every
+    value), the leaf pages (the values in order, where their posting list is
+    and the next leaf) and the inner pages up to the root.
+    A file is written once, by a bulk load of the values in order. The writes
+    done since are kept in a delta, in memory and in the .delta log next to
+    the file, and merged into a new file once there are MERGE_SIZE of them.
+    The decoded pages are kept in an LRU page cache.
+    The values of a composite index are the lists of the values of its
+    columns, in order, so the rows having the same leading values are next
+    to each other.
+    Pages and posting lists are encoded with the wire module
+'''
+
+import mmap
+import os
+import struct
+import threading
+from bisect import bisect_left, bisect_right, insort
+from collections import OrderedDict
+
+import datatypes
+import predicate
+import wire
+from type_def import Types
+
+MAGIC = b"ABKRBTR1"
+# magic, root page, height, number of values, number of ids
+HEADER = struct.Struct("!8sQIQQ")
+LENGTH = struct.Struct("!I")
+
+# bytes of the pages of the bulk load
+PAGE_SIZE = 4096
+# decoded pages kept in memory by every file
+PAGE_CACHE = 1024
+# changes kept in the delta before it is merged into a new file
+MERGE_SIZE = 10000
+
+BATCH_SIZE = 1000
+PROGRESS_EVERY = 10000
+
+INSERT = 1
+DELETE = 2
+
+
+def write(path: str, items) -> tuple:
+    '''
+        Bulk load of the file from the (value, ids) in the order of the values
+        returns the number of values and of ids
+    '''
+    temporary = path + ".tmp"
+    values = 0
+    ids = 0
+    with open(temporary, "wb") as f:
+        f.write(bytes(HEADER.size))
+        offset = HEADER.size
+
+        # the posting lists, the entries of the leaves are kept
+        entries = []
+        for value, posting in items:
+            data = wire.encode(list(posting))
+            f.write(data)
+            entries.append((value, offset, len(data), len(posting)))
+            offset += len(data)
+            values += 1
+            ids += len(posting)
+
+        # the leaves, the offset of a leaf is known before it's written,
+        # the wire INT of the next one has a fixed size
+        leaves = []
+        for start, end in _pages(entries, lambda entry: entry[0]):
+            page = entries[start:end]
+            leaves.append([0, [entry[0] for entry in page], [entry[1] for entry in page],
+                           [entry[2] for entry in page], [entry[3] for entry in page]])
+        encoded = [_page(leaf) for leaf in leaves]
+        level = []
+        for i, leaf in enumerate(leaves):
+            leaf[0] = offset + len(encoded[i]) if i + 1 < len(leaves) else 0
+            data = _page(leaf)
+            f.write(data)
+            level.append((leaf[1][0], offset))
+            offset += len(data)
+
+        # the inner pages, one level at a time
+        height = 1 if level else 0
+        while len(level) > 1:
+            upper = []
+            for start, end in _pages(level, lambda child: child[0]):
+                children = level[start:end]
+                data = _page([[child[0] for child in children], [child[1] for child in children]])
+                f.write(data)
+                upper.append((children[0][0], offset))
+                offset += len(data)
+            level = upper
+            height += 1
+
+        root = level[0][1] if level else 0
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, root, height, values, ids))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary, path)
+    return values, ids
+
+
+def _page(content: list) -> bytes:
+    data = wire.encode(content)
+    return LENGTH.pack(len(data)) + data
+
+
+def _key(value):
+    '''
+        The value as a key of the delta, a composite value is a list
+    '''
+    return tuple(value) if isinstance(value, list) else value
+
+
+def _bounds(conditions: list) -> tuple:
+    '''
+        (low, high) of the values matching the (Types operator, value)
+        conditions, both included, None is unbounded
+    '''
+    low = high = None
+    for operator, value in conditions:
+        if operator in (Types.EQ, Types.GT, Types.GE):
+            low = value if low is None else max(low, value)
+        if operator in (Types.EQ, Types.LT, Types.LE):
+            high = value if high is None else min(high, value)
+    return low, high
+
+
+def _pages(entries: list, key) -> list:
+    '''
+        (start, end) of the pages of about PAGE_SIZE bytes of the entries
+    '''
+    pages = []
+    start = 0
+    size = 0
+    for i, entry in enumerate(entries):
+        # the key and the numbers of the entry
+        size += len(wire.encode(key(entry))) + 40
+        if size >= PAGE_SIZE:
+            pages.append((start, i + 1))
+            start = i + 1
+            size = 0
+    if start < len(entries):
+        pages.append((start, len(entries)))
+    return pages
+
+
+class BTreeFile:
+    '''
+        Reader of a bulk loaded file
+    '''
+
+    def __init__(self, path: str):
+        self.path = path
+        self.__file = open(path, "rb")
+        self.__map = mmap.mmap(self.__file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.root, self.height, self.values, self.ids = HEADER.unpack_from(self.__map, 0)
+        if magic != MAGIC:
+            raise ValueError(path + " isn't a B+tree file")
+        self.__cache = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def close(self):
+        self.__map.close()
+        self.__file.close()
+
+    def __page(self, offset: int) -> list:
+        with self.__lock:
+            page = self.__cache.get(offset)
+            if page is not None:
+                self.__cache.move_to_end(offset)
+                return page
+        length, = LENGTH.unpack_from(self.__map, offset)
+        start = offset + LENGTH.size
+        page = wire.decode(self.__map[start:start + length])
+        with self.__lock:
+            self.__cache[offset] = page
+            if len(self.__cache) > PAGE_CACHE:
+                self.__cache.popitem(last=False)
+        return page
+
+    def posting(self, location: tuple) -> list:
+        offset, length = location
+        return wire.decode(self.__map[offset:offset + length])
+
+    def __leaf(self, value) -> int:
+        '''
+            Offset of the leaf where the value is, or would be
+        '''
+        offset = self.root
+        for _ in range(self.height - 1):
+            keys, children = self.__page(offset)
+            offset = children[max(bisect_right(keys, value) - 1, 0)] if value is not None else children[0]
+        return offset
+
+    def range(self, low=None, high=None):
+        '''
+            (value, number of ids, location of the posting list) of the values
+            from low to high (both included, None is unbounded), in order
+        '''
+        if self.height == 0:
+            return
+        offset = self.__leaf(low)
+        first = True
+        while offset:
+            following, keys, offsets, lengths, counts = self.__page(offset)
+            start = bisect_left(keys, low) if first and low is not None else 0
+            first = False
+            for i in range(start, len(keys)):
+                if high is not None and keys[i] > high:
+                    return
+                yield keys[i], counts[i], (offsets[i], lengths[i])
+            offset = following
+
+
+class BTreeIndex:
+    '''
+        A bulk loaded file and the delta of the writes done since
+        the delta maps a value to the (added, removed) sets of ids
+    '''
+
+    def __init__(self, path: str):
+        self.path = path
+        self.base = BTreeFile(path) if os.path.exists(path) else None
+        self.delta = {}
+        self.delta_values = []
+        self.changes = 0
+        # no merge while an ADD INDEX loads the file
+        self.building = False
+        self.__log = None
+        self.__lock = threading.RLock()
+        for operation, value, id in self.__read_log():
+            self.__change(operation, value, id)
+
+    # the delta
+
+    def __read_log(self):
+        '''
+            Changes of the .delta log, a record cut by a crash is dropped
+        '''
+        return wire.records(self.path + ".delta")
+
+    def __write_log(self, records: list):
+        if self.__log is None:
+            self.__log = open(self.path + ".delta", "ab")
+        self.__log.write(b"".join(wire.record(record) for record in records))
+        self.__log.flush()
+
+    def __change(self, operation: int, value, id):
+        change = self.delta.get(_key(value))
+        if change is None:
+            change = self.delta[_key(value)] = (set(), set())
+            insort(self.delta_values, value)
+        added, removed = change
+        if operation == INSERT:
+            removed.discard(id)
+            added.add(id)
+        else:
+            added.discard(id)
+            removed.add(id)
+        self.changes += 1
+
+    def insert(self, pairs: list):
+        '''
+            pairs are (value, id) of the inserted rows
+        '''
+        with self.__lock:
+            self.__write_log([[INSERT, value, id] for value, id in pairs])
+            for value, id in pairs:
+                self.__change(INSERT, value, id)
+            self.__merge_if_needed()
+
+    def delete(self, value, id):
+        with self.__lock:
+            self.__write_log([[DELETE, value, id]])
+            self.__change(DELETE, value, id)
+            self.__merge_if_needed()
+
+    # reading
+
+    def __ids(self, value, location: tuple = None) -> set:
+        ids = set(self.base.posting(location)) if location is not None else set()
+        change = self.delta.get(_key(value))
+        if change is not None:
+            added, removed = change
+            ids -= removed
+            ids |= added
+        return ids
+
+    def __entries(self, low=None, high=None):
+        '''
+            (value, number of ids in the file, location) of the file and of
+            the delta, merged in the order of the values
+        '''
+        base = self.base.range(low, high) if self.base is not None else iter(())
+        start = bisect_left(self.delta_values, low) if low is not None else 0
+        end = bisect_right(self.delta_values, high) if high is not None else len(self.delta_values)
+        delta = iter(self.delta_values[start:end])
+
+        entry = next(base, None)
+        value = next(delta, None)
+        while entry is not None or value is not None:
+            if value is None or (entry is not None and entry[0] < value):
+                yield entry
+                entry = next(base, None)
+            elif entry is None or value < entry[0]:
+                yield value, 0, None
+                value = next(delta, None)
+            else:
+                yield entry
+                entry = next(base, None)
+                value = next(delta, None)
+
+    def select(self, conditions: list) -> set:
+        '''
+            Ids of the values matching all the (Types operator, value)
+            conditions, the range of values is read in order
+        '''
+        low, high = _bounds(conditions)
+        tests = [(predicate.OPERATOR_FUNCTIONS[operator], value) for operator, value in conditions]
+
+        ids = set()
+        with self.__lock:
+            if low is not None and high is not None and low > high:
+                return ids
+            for value, _, location in self.__entries(low, high):
+                if all(test(value, bound) for test, bound in tests):
+                    ids |= self.__ids(value, location)
+        return ids
+
+    def select_prefix(self, conditions: list) -> set:
+        '''
+            Ids of the composite values whose leading values match the
+            conditions, a (Types operator, value) list for each leading
+            column, = for all of them but the last one. The values from the
+            smallest one having the prefix are read in order, until the prefix
+            or the range of the last column ends
+        '''
+        prefix = []
+        for column_conditions in conditions[:-1]:
+            values = {value for _, value in column_conditions}
+            if len(values) > 1:
+                return set()
+            prefix.append(values.pop())
+        size = len(prefix)
+        low, high = _bounds(conditions[-1])
+        tests = [(predicate.OPERATOR_FUNCTIONS[operator], value) for operator, value in conditions[-1]]
+
+        ids = set()
+        with self.__lock:
+            if low is not None and high is not None and low > high:
+                return ids
+            for value, _, location in self.__entries(prefix + [low] if low is not None else prefix):
+                if value[:size] != prefix or (high is not None and value[size] > high):
+                    break
+                if all(test(value[size], bound) for test, bound in tests):
+                    ids |= self.__ids(value, location)
+        return ids
+
+    def lookup(self, values: list) -> list:
+        '''
+            Ids of the rows having one of the values
+        '''
+        ids = []
+        with self.__lock:
+            for value in set(values):
+                for _, _, location in self.__entries(value, value):
+                    ids += self.__ids(value, location)
+        return ids
+
+    def existing(self, values: list) -> set:
+        '''
+            The values having at least one row
+        '''
+        with self.__lock:
+            return {value for value in set(values)
+                    if any(self.__ids(value, location)
+                           for _, _, location in self.__entries(value, value))}
+
+    def distinct(self) -> int:
+        '''
+            Estimated number of values
+        '''
+        with self.__lock:
+            base = self.base.values if self.base is not None else 0
+            return base + len(self.delta)
+
+    def postings(self) -> list:
+        '''
+            (value, number of ids) of every value, in order
+        '''
+        postings = []
+        with self.__lock:
+            for value, count, location in self.__entries():
+                if _key(value) in self.delta:
+                    count = len(self.__ids(value, location))
+                if count:
+                    postings.append((value, count))
+        return postings
+
+    # writing new files
+
+    def load(self, pairs):
+        '''
+            Bulk load of the (value, id) pairs in the order of the values,
+            the delta of the writes done meanwhile stays on top of them
+        '''
+        def items():
+            posting = []
+            current = None
+            for value, id in pairs:
+                if posting and value != current:
+                    yield current, posting
+                    posting = []
+                current = value
+                posting.append(id)
+            if posting:
+                yield current, posting
+
+        with self.__lock:
+            self.__replace(items())
+
+    def __merge_if_needed(self):
+        if self.changes >= MERGE_SIZE and not self.building:
+            self.merge()
+
+    def merge(self):
+        '''
+            Writes the file with the delta, then empties the delta
+        '''
+        with self.__lock:
+            def items():
+                for value, _, location in self.__entries():
+                    ids = self.__ids(value, location)
+                    if ids:
+                        yield value, sorted(ids, key=_order)
+
+            self.__replace(items(), merged=True)
+
+    def __replace(self, items, merged: bool = False):
+        write(self.path + ".new", items)
+        if self.base is not None:
+            self.base.close()
+        os.replace(self.path + ".new", self.path)
+        self.base = BTreeFile(self.path)
+        if merged:
+            if self.__log is not None:
+                self.__log.close()
+            self.__log = open(self.path + ".delta", "wb")
+            self.delta = {}
+            self.delta_values = []
+            self.changes = 0
+
+    def sync(self):
+        with self.__lock:
+            if self.__log is not None:
+                os.fsync(self.__log.fileno())
+
+    def close(self):
+        with self.__lock:
+            if self.base is not None:
+                self.base.close()
+                self.base = None
+            if self.__log is not None:
+                self.__log.close()
+                self.__log = None
+
+    def drop(self):
+        self.close()
+        for path in (self.path, self.path + ".delta", self.path + ".new"):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def _order(id):
+    return (type(id).__name__, id)
+
+
+def build(index: BTreeIndex, schema, columns: list, table, progress=None):
+    '''
+        Bulk loads the index of the columns (more than one for a composite
+        index) from the rows of the table, the writes running meanwhile are
+        kept in the delta of the index, nulls are not indexed
+        progress(done, total) is called every PROGRESS_EVERY rows
+    '''
+    total = table.estimated_document_count()
+    fields = [schema.field(column) for column in columns]
+    projection = {field: 1 for field in fields} if schema.typed else {"Value": 1}
+    pairs = []
+    done = 0
+    for document in table.find({}, projection).batch_size(BATCH_SIZE):
+        row = datatypes.row(schema, document)
+        value = [row[field] for field in fields]
+        if None not in value:
+            pairs.append((value if len(value) > 1 else value[0], document["_id"]))
+        done += 1
+        if progress is not None and done % PROGRESS_EVERY == 0:
+            progress(done, total)
+    pairs.sort(key=lambda pair: pair[0])
+    index.load(pairs)
+    if progress is not None:
+        progress(done, total)
+
+
+class BTreeStore:
+    '''
+        The open B+tree indexes, (db, table, column) -> BTreeIndex
+    '''
+
+    def __init__(self):
+        self.__indexes = {}
+        self.__lock = threading.Lock()
+
+    @staticmethod
+    def path(db: str, table: str, column: str) -> str:
+        return db + '/' + table + '.' + column + '.btree'
+
+    def get(self, db: str, table: str, column: str) -> BTreeIndex:
+        key = (db, table, column)
+        with self.__lock:
+            index = self.__indexes.get(key)
+            if index is None:
+                index = self.__indexes[key] = BTreeIndex(self.path(db, table, column))
+            return index
+
+    def drop(self, db: str, table: str, column: str):
+        self.get(db, table, column).drop()
+        with self.__lock:
+            del self.__indexes[(db, table, column)]
+
+    def drop_database(self, db: str):
+        with self.__lock:
+            for key in [key for key in self.__indexes if key[0] == db]:
+                self.__indexes.pop(key).close()
+
+    def sync(self):
+        with self.__lock:
+            indexes = list(self.__indexes.values())
+        for index in indexes:
+            index.sync()
@@ -0,0 +1,180 @@
+'''
+    Schema catalog
+    Keeps the <db>/<table>.json schema files parsed in memory
+'''
+
+import json
+import os
+import threading
+
+
+class Column:
+    '''
+        One column of a table, position is its index in the json list
+    '''
+
+    __slots__ = ('name', 'position', 'type', 'index', 'index_kind', 'index_building', 'unique', 'unique_table',
+                 'primary_key', 'foreign_key', 'parent_table')
+
+    def __init__(self, position: int, data: dict):
+        self.name = data["column_name"]
+        self.position = position
+        self.type = data["type"]
+        self.index = data["index"] == "true"
+        # "table" for the index_<table>_<column> collection,
+        # "buckets" for the posting lists in buckets of index_<table>_<column>
+        # and index_<table>_<column>.buckets, the ADD INDEX default,
+        # "btree" for the btree file of the column,
+        # "bitmap" for the bitmaps of the column
+        self.index_kind = data.get("index_kind", "table")
+        # the index is being filled by ADD INDEX, the writes update it,
+        # the reads don't use it yet
+        self.index_building = data.get("index_building") == "true"
+        self.unique = data["unique"] == "true"
+        # the values of a unique column of an old table are kept
+        # in the uq_<table>_<column> collection
+        self.unique_table = data.get("unique_table") == "true"
+        self.primary_key = data["primary_key"] == "true"
+        self.foreign_key = data["foreign_key"] == "true"
+        self.parent_table = data["parent_table"] == "true"
+
+    @property
+    def index_ready(self) -> bool:
+        '''
+            The column has an index the reads can use
+        '''
+        return self.index and not self.index_building
+
+
+class ForeignKey:
+    '''
+        A foreign key (or a child table link) between two columns
+        key is the column of this table, column is the one of the other table
+    '''
+
+    __slots__ = ('key', 'key_position', 'key_type',
+                 'table', 'column', 'column_position', 'column_type')
+
+    def __init__(self, data: dict):
+        self.key, self.key_position, self.key_type = data["key"]
+        self.table = data["table"]
+        self.column, self.column_position, self.column_type = data["column"]
+
+
+class TableSchema:
+    '''
+        Parsed schema of a table
+    '''
+
+    __slots__ = ('name', 'columns', 'names', 'types', 'by_name', 'typed',
+                 'primary_keys', 'foreign_keys', 'child_tables', 'composite_indexes',
+                 'composite_builds', 'stamp')
+
+    def __init__(self, name: str, data: list, stamp: tuple):
+        self.name = name
+        self.stamp = stamp
+        self.columns = [Column(i, col) for i, col in enumerate(data) if i]
+        self.names = [col.name for col in self.columns]
+        self.types = [col.type for col in self.columns]
+        self.by_name = {col.name: col for col in self.columns}
+        # rows stored with one field per column, not in a "#" joined string
+        self.typed = data[0].get("storage") == "columns"
+        self.primary_keys = [pk[0] for pk in data[0]["primary_keys"]]
+        self.foreign_keys = [ForeignKey(fk) for fk in data[0]["foreign_keys"]]
+        self.child_tables = [ForeignKey(fk) for fk in data[0]["child_tables"]]
+        # the columns of the composite indexes, in the order of their values
+        self.composite_indexes = [tuple(columns) for columns in data[0].get("composite_indexes", [])]
+        # the composite indexes being loaded by ADD INDEX, the writes update
+        # them, the planner doesn't use them yet
+        self.composite_builds = [tuple(columns) for columns in data[0].get("composite_builds", [])]
+
+    @property
+    def pk(self) -> Column:
+        return self.columns[0]
+
+    def column(self, name: str) -> Column | None:
+        return self.by_name.get(name)
+
+    def has_column(self, name: str) -> bool:
+        return name in self.by_name
+
+    def field(self, name: str) -> str:
+        '''
+            Name of the field storing the column, the primary key is the _id
+        '''
+        return "_id" if name == self.columns[0].name else name
+
+
+class Catalog:
+    '''
+        Every schema file is parsed once, then served from memory
+        A cached schema is reloaded if its file was changed on disk
+        by someone else (checked with the modification time and size)
+    '''
+
+    def __init__(self):
+        self.__tables = {}
+        self.__lock = threading.RLock()
+
+    @staticmethod
+    def path(db: str, table: str) -> str:
+        return db + '/' + table + '.json'
+
+    @staticmethod
+    def __stamp(path: str) -> tuple | None:
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def exists(self, db: str, table: str) -> bool:
+        return self.__stamp(self.path(db, table)) is not None
+
+    def get(self, db: str, table: str) -> TableSchema | None:
+        '''
+            Returns the schema of the table, None if it has no schema file
+        '''
+        path = self.path(db, table)
+        stamp = self.__stamp(path)
+        with self.__lock:
+            schema = self.__tables.get((db, table))
+            if stamp is None:
+                self.__tables.pop((db, table), None)
+                return None
+            if schema is not None and schema.stamp == stamp:
+                return schema
+
+            schema = TableSchema(table, self.load(db, table), stamp)
+            self.__tables[(db, table)] = schema
+            return schema
+
+    def load(self, db: str, table: str) -> list:
+        '''
+            Reads the raw json content of the schema, used for editing it
+        '''
+        with open(self.path(db, table), "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def save(self, db: str, table: str, data: list):
+        '''
+            Writes the schema to disk and updates the cached version
+        '''
+        path = self.path(db, table)
+        with self.__lock:
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(data, f, indent=4)
+            self.__tables[(db, table)] = TableSchema(
+                table, data, self.__stamp(path))
+
+    def drop(self, db: str, table: str):
+        with self.__lock:
+            self.__tables.pop((db, table), None)
+            path = self.path(db, table)
+            if os.path.exists(path):
+                os.remove(path)
+
+    def drop_database(self, db: str):
+        with self.__lock:
+            for key in [key for key in self.__tables if key[0] == db]:
+                del self.__tables[key]
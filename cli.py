@@ -1,7 +1,10 @@
 import socket
 
 import parse
+import protocol
+from protocol import Kind
 from type_def import Types
+import wire
 import tabulate as tb
 
 PORT = 43569
@@ -9,6 +12,49 @@ HOST = "localhost"
 BUFF_SIZE = 1024
 
 
+class TablePrinter:
+    '''
+        Prints a table while its rows arrive from the server
+        the width of the columns is given by the header and the first batch
+    '''
+
+    def __init__(self):
+        self.columns = None
+        self.widths = None
+
+    def __call__(self, kind: Kind, data: list):
+        if kind == Kind.PROGRESS:
+            print(str(data[0]) + "/" + str(data[1]) + " rows")
+            return
+
+        if kind == Kind.COLUMNS:
+            self.columns = data
+            self.widths = None
+            return
+
+        # the rows of protocol version 2 are typed
+        data = [[wire.text(value) for value in row] for row in data]
+        if self.widths is None:
+            self.__print_header(data)
+        for row in data:
+            print(self.__line(row))
+
+    def finish(self):
+        if self.columns is not None and self.widths is None:
+            self.__print_header([])
+        self.columns = None
+
+    def __print_header(self, rows: list):
+        self.widths = [max(len(value) for value in column)
+                       for column in zip(self.columns, *rows)]
+        print(self.__line(self.columns))
+        print("  ".join("-" * width for width in self.widths))
+
+    def __line(self, row: list) -> str:
+        return "  ".join(value.ljust(width)
+                         for value, width in zip(row, self.widths))
+
+
 class CLI:
     '''
         CLI class
@@ -16,42 +62,65 @@ class CLI:
 
     current_db = None
 
-    def __init__(self):
+    def __init__(self, legacy: bool = False):
         self.command_list = []
+        self.legacy = legacy
+        self.connection = None
+        self.printer = TablePrinter()
 
     def run(self):
         '''
             Starts the CLI
+            several commands can be given on one line, separated by ';'
+            fetch <n> sets how many rows the server sends at once
         '''
 
         while True:
-            command = input(f"{self.current_db}> ")
-            self.command_list = parse.tokenize(command)
+            commands = input(f"{self.current_db}> ").split(';')
+            statements = [parse.tokenize(command.strip()) for command in commands
+                          if command.strip()]
 
-            if len(self.command_list) == 0:
+            if len(statements) == 0:
                 continue
 
             # exit
-            if len(self.command_list
-                   ) == 1 and self.command_list[0] == Types.EXIT:
-                break
+            exit_idx = [idx for idx, command_list in enumerate(statements)
+                        if command_list == [Types.EXIT]]
+            if exit_idx:
+                statements = statements[:exit_idx[0]]
+
+            # fetch size
+            if len(statements) == 1 and len(statements[0]) == 2\
+                    and statements[0][0] == 'fetch':
+                self.__set_fetch_size(statements[0][1])
+                continue
 
-            try:
-                self.__check_then_run()
+            if self.legacy:
+                for command_list in statements:
+                    self.command_list = command_list
+                    try:
+                        self.__check_then_run()
+                        self.__update_state()
+                    except Exception as e:
+                        print(f"Error. {e}")
+            else:
+                self.__run_pipelined(statements)
 
-                # use
-                if len(self.command_list
-                       ) == 2 and self.command_list[0] == Types.USE:
-                    self.current_db = self.command_list[1]
-                # drop
-                if (len(self.command_list) == 3
-                        and self.command_list[0] == Types.DROP
-                    and self.command_list[1] == Types.DATABASE
-                        and self.current_db == self.command_list[2]):
-                    self.current_db = None
+            if exit_idx:
+                self.__disconnect()
+                break
 
-            except Exception as e:
-                print(f"Error. {e}")
+    def __update_state(self):
+        # use
+        if len(self.command_list
+               ) == 2 and self.command_list[0] == Types.USE:
+            self.current_db = self.command_list[1]
+        # drop
+        if (len(self.command_list) == 3
+                and self.command_list[0] == Types.DROP
+            and self.command_list[1] == Types.DATABASE
+                and self.current_db == self.command_list[2]):
+            self.current_db = None
 
     def __check_then_run(self):
         '''
@@ -59,30 +128,133 @@ class CLI:
             if correct run
         '''
         if parse.parse(self.command_list):
+            if self.legacy:
+                response = self.__execute_one_shot(self.__list_to_string())
+            else:
+                try:
+                    response = self.__connect().execute(self.__command(),
+                                                        self.printer)
+                except OSError as e:
+                    self.__disconnect()
+                    raise Exception("Connection to the server lost.") from e
+            self.__handle_response(response)
+        else:
+            raise Exception("Wrong input.")
 
-            s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)  # TCP socket
-            s.connect((HOST, PORT))
+    def __run_pipelined(self, statements: list):
+        '''
+            Sends every correct command, then waits for the answers
+        '''
+        try:
+            connection = self.__connect()
+            sent = []
+            for command_list in statements:
+                self.command_list = command_list
+                request_id = None
+                if parse.parse(command_list):
+                    request_id = connection.send(self.__command())
+                sent.append((command_list, request_id))
 
-            string_command_list = self.__list_to_string()
+            for command_list, request_id in sent:
+                self.command_list = command_list
+                try:
+                    if request_id is None:
+                        raise Exception("Wrong input.")
+                    self.__handle_response(
+                        connection.result(request_id, self.printer))
+                    self.__update_state()
+                except OSError:
+                    raise
+                except Exception as e:
+                    print(f"Error. {e}")
+        except OSError as e:
+            self.__disconnect()
+            print(f"Error. Connection to the server lost. {e}")
 
-            s.send(string_command_list.encode())
+    def __handle_response(self, response: str):
+        self.printer.finish()
+        if response == "done":
+            return
 
-            response = s.recv(BUFF_SIZE).decode()
-            s.close()
+        if response.split(' ')[0] == 'TABLE':
+            self.__print_table(response)
+            return
 
-            if response == "done":
-                return
+        raise Exception(response)
 
-            if response.split(' ')[0] == 'TABLE':
-                print(response)
-                self.__print_table(response)
-                return
+    def __execute_one_shot(self, command: str) -> str:
+        '''
+            Old protocol, a new connection for every command
+        '''
+        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)  # TCP socket
+        s.connect((HOST, PORT))
 
-            raise Exception(response)
-        else:
-            raise Exception("Wrong input.")
+        s.send(command.encode())
+
+        # the server closes the connection after the answer
+        response = b""
+        while chunk := s.recv(BUFF_SIZE):
+            response += chunk
+        s.close()
+        return response.decode()
+
+    def __set_fetch_size(self, fetch_size: str):
+        if self.legacy or not fetch_size.isdigit() or int(fetch_size) == 0:
+            print("Error. Wrong input.")
+            return
+        try:
+            self.__connect().set_fetch_size(int(fetch_size))
+        except OSError as e:
+            self.__disconnect()
+            print(f"Error. Connection to the server lost. {e}")
+
+    def __connect(self) -> protocol.Connection:
+        '''
+            The connection is kept open, the server keeps the state
+            of the session (the used database) as long as it lives
+        '''
+        if self.connection is None:
+            self.connection = protocol.Connection(HOST, PORT)
+            if self.current_db is not None:
+                self.connection.execute([Types.USE, self.current_db])
+        return self.connection
 
-    def __list_to_string(self) -> str:
+    def __disconnect(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def __command(self, command_list: list = None) -> list:
+        '''
+            The command in the binary encoding of protocol version 2,
+            the keywords stay Types, the rows of an INSERT and the statement
+            of a PREPARE are nested lists
+        '''
+        if command_list is None:
+            command_list = self.command_list
+
+        if command_list[0] == Types.INSERT:
+            return [Types.INSERT, command_list[2]] + parse.split_rows(command_list[4:])
+
+        # PREPARE name AS statement
+        if command_list[0] == Types.PREPARE:
+            return [Types.PREPARE, command_list[1], self.__command(command_list[3:])]
+
+        # EXECUTE name [USING] values
+        if command_list[0] == Types.EXECUTE:
+            return [Types.EXECUTE, command_list[1]]\
+                + [value for value in command_list[2:] if value != 'using']
+
+        command = []
+        for idx, token in enumerate(command_list):
+            command.append(token)
+            if token == Types.SELECT and command_list[idx + 1] != Types.ALL:
+                command.append(Types.COLUMNS)
+        return command
+
+    def __list_to_string(self, command_list: list = None) -> str:
+        if command_list is None:
+            command_list = self.command_list
 
         def merge(str_list: list) -> str:
             string = ""
@@ -95,17 +267,27 @@ class CLI:
         string_command_list = ""
 
         # if needs param merge
-        if self.command_list[0] == Types.INSERT:
-            merged = merge(self.command_list[4:])
+        if command_list[0] == Types.INSERT:
+            merged = " ".join(merge(row) for row in parse.split_rows(command_list[4:]))
             string_command_list = str(
-                self.command_list[0].value
-            ) + " " + self.command_list[2] + " " + merged
+                command_list[0].value
+            ) + " " + command_list[2] + " " + merged
             return string_command_list
 
-        for idx, command in enumerate(self.command_list):
+        # PREPARE name AS statement, the statement is encoded as usual
+        if command_list[0] == Types.PREPARE:
+            return str(Types.PREPARE.value) + " " + command_list[1] + " "\
+                + self.__list_to_string(command_list[3:])
+
+        # EXECUTE name [USING] values
+        if command_list[0] == Types.EXECUTE:
+            values = [value for value in command_list[2:] if value != 'using']
+            return " ".join([str(Types.EXECUTE.value), command_list[1]] + values)
+
+        for idx, command in enumerate(command_list):
             if isinstance(command, Types):
                 string_command_list += str(command.value) + " "
-                if command == Types.SELECT and self.command_list[idx + 1]\
+                if command == Types.SELECT and command_list[idx + 1]\
                         != Types.ALL:
                     string_command_list += str(Types.COLUMNS.value) + " "
             else:
@@ -115,15 +297,5 @@ class CLI:
         return string_command_list
 
     def __print_table(self, table: str) -> None:
-        table_split = table.split(' ')
-        nr = int(table_split[1])
-
-        with open('select.txt', 'r') as f:
-            data = f.read().replace('\n', '')
-        data = data.split(" ")
-        d = [data[i: i + nr] for i in range(0, len(data), nr)]
-        final_table = []
-        for elem in d:
-            if elem not in final_table:
-                final_table.append(elem)
-        print (tb.tabulate(final_table[1:], headers=final_table[0]))
+        data = [line.split(' ') for line in table.split('\n')[1:]]
+        print(tb.tabulate(data[1:], headers=data[0]))
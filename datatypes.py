@@ -0,0 +1,70 @@
+'''
+    Conversion between the textual and the stored form of the column values
+    Rows are stored with one typed field for every column, the primary key
+    is the _id. Old tables kept the other columns in a "#" joined Value string
+'''
+
+from datetime import datetime
+
+DATE_FORMAT = "%Y-%m-%d"
+DATETIME_FORMAT = "%Y-%m-%d_%H:%M:%S"
+
+
+def convert(value: str, type: str):
+    '''
+        Typed value of a string given by the user
+        dates are stored as (naive, UTC) datetimes
+    '''
+    match type:
+        case 'int':
+            return int(value)
+        case 'float':
+            return float(value)
+        case 'bit':
+            return int(value)
+        case 'date':
+            return datetime.strptime(value, DATE_FORMAT)
+        case 'datetime':
+            return datetime.strptime(value, DATETIME_FORMAT)
+        case _:
+            return value
+
+
+def to_string(value, type: str) -> str:
+    match type:
+        case 'date':
+            return value.strftime(DATE_FORMAT)
+        case 'datetime':
+            return value.strftime(DATETIME_FORMAT)
+        case _:
+            return str(value)
+
+
+def to_document(schema, data_list: list) -> dict:
+    '''
+        Stored form of a row given as strings, in the order of the columns
+    '''
+    document = {"_id": convert(data_list[0], schema.pk.type)}
+    for column, value in zip(schema.columns[1:], data_list[1:]):
+        document[column.name] = convert(value, column.type)
+    return document
+
+
+def from_legacy(schema, document: dict) -> dict:
+    '''
+        Converts a row of the old, "#" joined format
+    '''
+    row = {"_id": document["_id"]}
+    values = document["Value"].split("#")
+    for column, value in zip(schema.columns[1:], values):
+        row[column.name] = convert(value, column.type)
+    return row
+
+
+def row(schema, document: dict) -> dict:
+    '''
+        The typed row of a stored document, old rows are converted
+    '''
+    if schema.typed or "Value" not in document:
+        return document
+    return from_legacy(schema, document)
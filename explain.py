@@ -0,0 +1,148 @@
+'''
+    EXPLAIN and EXPLAIN ANALYZE of a SELECT
+    the stages of the query are recorded in a Trace, EXPLAIN ANALYZE also
+    measures them: time, rows, MongoDB round trips, documents and bytes
+    received, counted by a pymongo command listener
+'''
+
+import threading
+import time
+from contextlib import contextmanager
+
+import bson
+from pymongo import monitoring
+
+COLUMNS = ["stage", "detail", "estimated", "rows", "ms", "round_trips", "documents", "bytes"]
+
+
+class MongoCounters(threading.local):
+    '''
+        Totals of the commands sent by the current thread
+    '''
+
+    def __init__(self):
+        super().__init__()
+        # only the commands of an EXPLAIN ANALYZE are measured
+        self.enabled = False
+        self.round_trips = 0
+        self.documents = 0
+        self.bytes = 0
+
+    def snapshot(self) -> tuple:
+        return self.round_trips, self.documents, self.bytes
+
+
+counters = MongoCounters()
+
+
+class MongoListener(monitoring.CommandListener):
+    '''
+        The listener is called in the thread running the command
+    '''
+
+    def started(self, event):
+        if counters.enabled:
+            counters.round_trips += 1
+
+    def succeeded(self, event):
+        if not counters.enabled:
+            return
+        reply = event.reply
+        counters.bytes += len(bson.encode(reply))
+        cursor = reply.get("cursor")
+        if cursor is not None:
+            counters.documents += len(cursor.get("firstBatch", cursor.get("nextBatch", [])))
+
+    def failed(self, event):
+        pass
+
+
+def register():
+    '''
+        Has to be called before the MongoClient is created
+    '''
+    monitoring.register(MongoListener())
+
+
+class Stage:
+
+    __slots__ = ('name', 'detail', 'estimated', 'rows', 'seconds', 'mongo')
+
+    def __init__(self, name: str, detail: str, estimated):
+        self.name = name
+        self.detail = detail
+        self.estimated = estimated
+        self.rows = None
+        self.seconds = 0.0
+        self.mongo = (0, 0, 0)
+
+    def add(self, seconds: float, before: tuple, after: tuple):
+        self.seconds += seconds
+        self.mongo = tuple(total + b - a for total, a, b in zip(self.mongo, before, after))
+
+
+class Trace:
+    '''
+        The stages are listed in the order they were planned, the time and
+        the counters of a stage streaming rows include the stages feeding it
+    '''
+
+    def __init__(self, analyze: bool):
+        self.analyze = analyze
+        self.stages = []
+
+    @contextmanager
+    def active(self):
+        counters.enabled = self.analyze
+        try:
+            yield
+        finally:
+            counters.enabled = False
+
+    def add(self, name: str, detail: str, estimated=None) -> Stage:
+        stage = Stage(name, detail, estimated)
+        self.stages.append(stage)
+        return stage
+
+    @contextmanager
+    def timed(self, stage: Stage):
+        before = counters.snapshot()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            stage.add(time.perf_counter() - start, before, counters.snapshot())
+
+    def measure(self, stage: Stage, rows):
+        '''
+            Generator of the rows, counting them and the time spent producing them
+        '''
+        stage.rows = stage.rows or 0
+        iterator = iter(rows)
+        while True:
+            before = counters.snapshot()
+            start = time.perf_counter()
+            try:
+                row = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                stage.add(time.perf_counter() - start, before, counters.snapshot())
+            stage.rows += 1
+            yield row
+
+    def rows(self) -> list:
+        def text(value):
+            if value is None:
+                return "-"
+            return str(round(value)) if isinstance(value, float) else str(value)
+
+        rows = []
+        for stage in self.stages:
+            row = [stage.name, stage.detail, text(stage.estimated)]
+            if self.analyze:
+                row += [text(stage.rows), "%.3f" % (stage.seconds * 1000)] + [str(n) for n in stage.mongo]
+            else:
+                row += ["-"] * 5
+            rows.append(row)
+        return rows
@@ -0,0 +1,80 @@
+'''
+    Online build of the posting table of a column
+    the rows already in the table are streamed in batches, their postings are
+    gathered in memory and appended every time SPILL_SIZE ids are buffered.
+    The writes running during the build are captured by the IndexBuild
+    registered for the column
+'''
+
+import threading
+
+import datatypes
+
+BATCH_SIZE = 1000
+SPILL_SIZE = 100000
+PROGRESS_EVERY = 10000
+
+
+class IndexBuild:
+    '''
+        A posting table being filled, the writes running in the meantime
+        append their entries too, the values they touch are compacted at the
+        end, so the ids seen by them and by the scan are counted once.
+        The deletes are kept in deleted (id -> value) and appended again
+        at the end, once the scan can't add them back
+    '''
+
+    def __init__(self, schema, column: str):
+        self.schema = schema
+        self.column = schema.column(column)
+        self.deleted = {}
+        self.touched = set()
+        self.__lock = threading.Lock()
+
+    def inserted(self, pairs: list):
+        with self.__lock:
+            for value, id in pairs:
+                self.deleted.pop(id, None)
+                self.touched.add(value)
+
+    def removed(self, id, value):
+        with self.__lock:
+            self.deleted[id] = value
+            self.touched.add(value)
+
+    def run(self, table, postings, lock, progress=None):
+        '''
+            Fills the posting table from table, lock() locks the table
+            while the postings are written
+            progress(done, total) is called every PROGRESS_EVERY rows
+        '''
+        total = table.estimated_document_count()
+        field = self.schema.field(self.column.name)
+        projection = {field: 1} if self.schema.typed else {"Value": 1}
+
+        pairs = []
+        done = 0
+        for document in table.find({}, projection).batch_size(BATCH_SIZE):
+            pairs.append((datatypes.row(self.schema, document)[field], document["_id"]))
+            done += 1
+            if len(pairs) >= SPILL_SIZE:
+                with lock():
+                    postings.insert(pairs)
+                pairs = []
+            if progress is not None and done % PROGRESS_EVERY == 0:
+                progress(done, total)
+
+        with lock():
+            if pairs:
+                postings.insert(pairs)
+            with self.__lock:
+                deleted = self.deleted
+                touched = self.touched
+                self.deleted = {}
+                self.touched = set()
+            for id, value in deleted.items():
+                postings.delete(value, id, compact=False)
+            postings.compact(list(touched))
+
+        if progress is not None:
+            progress(done, total)
@@ -0,0 +1,47 @@
+'''
+    Join operators
+    the rows are dicts keyed by "alias.column", the joined row is the union
+    of the outer and the inner row
+'''
+
+BATCH_SIZE = 1000
+
+
+def qualify(alias: str, schema, row: dict) -> dict:
+    return {alias + "." + name: row[schema.field(name)] for name in schema.names}
+
+
+def hash_join(outer, inner, outer_key: str, inner_key: str):
+    '''
+        Builds a hash table of the inner rows, then streams the outer ones,
+        probing the table with their key
+    '''
+    table = {}
+    for row in inner:
+        table.setdefault(row[inner_key], []).append(row)
+
+    for row in outer:
+        for match in table.get(row[outer_key], ()):
+            yield {**row, **match}
+
+
+def index_nested_loop_join(outer, lookup, outer_key: str, batch_size: int = BATCH_SIZE):
+    '''
+        lookup(keys) returns the inner rows having one of the keys,
+        as a dict key -> rows; it is called once for every batch of outer rows
+    '''
+    batch = []
+    for row in outer:
+        batch.append(row)
+        if len(batch) == batch_size:
+            yield from _probe(batch, lookup, outer_key)
+            batch = []
+    if batch:
+        yield from _probe(batch, lookup, outer_key)
+
+
+def _probe(batch: list, lookup, outer_key: str):
+    matches = lookup({row[outer_key] for row in batch})
+    for row in batch:
+        for match in matches.get(row[outer_key], ()):
+            yield {**row, **match}
@@ -0,0 +1,94 @@
+'''
+    Cache of the values of the columns referenced by foreign keys
+    a column without an index would have to be scanned for every inserted
+    child row, instead its values are counted once and kept in memory
+'''
+
+import threading
+from collections import Counter, OrderedDict
+
+MAX_KEYS = 1000000
+
+
+class KeyCache:
+    '''
+        (db, table, column) -> Counter of the values of the column
+        the counts are kept current by the inserts and deletes, so a value
+        is dropped when its last row is deleted. The least recently used
+        columns are evicted when more than max_keys values are cached,
+        a column having more values is not cached at all, it is remembered
+        in oversize until its table is dropped or migrated
+    '''
+
+    def __init__(self, max_keys: int = MAX_KEYS):
+        self.max_keys = max_keys
+        self.__entries = OrderedDict()
+        self.__size = 0
+        self.__oversize = set()
+        self.__lock = threading.Lock()
+
+    def get(self, key: tuple, values) -> Counter | None:
+        '''
+            The counts of the column, values() yields the values of
+            the column, it is called if the column isn't cached yet
+            returns None if the column is too big for the cache
+        '''
+        with self.__lock:
+            counts = self.__entries.get(key)
+            if counts is not None:
+                self.__entries.move_to_end(key)
+                return counts
+            if key in self.__oversize:
+                return None
+
+        counts = Counter()
+        for value in values():
+            counts[value] += 1
+            if len(counts) > self.max_keys:
+                with self.__lock:
+                    self.__oversize.add(key)
+                return None
+
+        with self.__lock:
+            if key not in self.__entries:
+                self.__entries[key] = counts
+                self.__size += len(counts)
+                self.__evict()
+            return counts
+
+    def add(self, key: tuple, values: list):
+        with self.__lock:
+            counts = self.__entries.get(key)
+            if counts is None:
+                return
+            before = len(counts)
+            counts.update(values)
+            self.__size += len(counts) - before
+            self.__evict()
+
+    def remove(self, key: tuple, values: list):
+        with self.__lock:
+            counts = self.__entries.get(key)
+            if counts is None:
+                return
+            for value in values:
+                counts[value] -= 1
+                if counts[value] <= 0:
+                    del counts[value]
+                    self.__size -= 1
+
+    def drop(self, db: str, table: str | None = None):
+        '''
+            Forgets the columns of a table, or of the whole database
+        '''
+        with self.__lock:
+            for key in [key for key in self.__entries
+                        if key[0] == db and table in (None, key[1])]:
+                self.__size -= len(self.__entries.pop(key))
+            self.__oversize = {key for key in self.__oversize
+                               if key[0] != db or table not in (None, key[1])}
+
+    def __evict(self):
+        while self.__size > self.max_keys and self.__entries:
+            _, counts = self.__entries.popitem(last=False)
+            self.__size -= len(counts)
@@ -0,0 +1,804 @@
+'''
+    Embedded storage engine, the "local" backend of storage
+    The collections live in the server process, as dicts _id -> document,
+    and on disk in <path>/<db>/<collection>.*: every write appends the
+    documents it changed to the .log file, which is folded into the .bson
+    snapshot once it holds more records than the collection has documents
+    Lookups of _id and of the fields of an index are dict lookups, ranges of
+    _id are read from the sorted list of the ids
+    Values are compared like MongoDB does: only values of the same kind
+    (numbers, strings, dates, ...) are compared with each other
+'''
+
+import os
+import shutil
+import threading
+from bisect import bisect_left, bisect_right, insort
+from datetime import datetime
+
+import bson
+
+from storage import DuplicateKeyError, ReplaceOne, UpdateOne
+
+# the log is compacted once it has this many records, and more than the documents
+COMPACT_MIN = 10000
+# new ids merged one by one into the sorted ids, more are sorted in
+MERGE_ONE_BY_ONE = 32
+
+SNAPSHOT = ".bson"
+LOG = ".log"
+LENGTH_SIZE = 4
+
+MISSING = object()
+
+
+def _rank(value) -> int:
+    '''
+        Kind of the value, in the order MongoDB sorts them
+    '''
+    if value is None or value is MISSING:
+        return 0
+    if isinstance(value, bool):
+        return 8
+    if isinstance(value, (int, float)):
+        return 1
+    if isinstance(value, str):
+        return 2
+    if isinstance(value, dict):
+        return 3
+    if isinstance(value, list):
+        return 4
+    if isinstance(value, bytes):
+        return 5
+    if isinstance(value, bson.ObjectId):
+        return 7
+    if isinstance(value, datetime):
+        return 9
+    return 10
+
+
+def _sort_key(value) -> tuple:
+    rank = _rank(value)
+    if rank == 0:
+        return (0,)
+    if rank in (3, 4):
+        # documents and arrays are ordered by their encoding
+        return rank, bson.encode({"v": value})
+    return rank, value
+
+
+def _hashable(value):
+    if isinstance(value, list):
+        return tuple(_hashable(item) for item in value)
+    if isinstance(value, dict):
+        return tuple((key, _hashable(item)) for key, item in value.items())
+    return value
+
+
+def _equal(value, other) -> bool:
+    if value is MISSING:
+        return other is None
+    if isinstance(value, list) and not isinstance(other, list):
+        return any(_equal(item, other) for item in value)
+    return _rank(value) == _rank(other) and value == other
+
+
+def _compare(value, other, test) -> bool:
+    if value is MISSING:
+        return False
+    if isinstance(value, list):
+        return any(_compare(item, other, test) for item in value)
+    return _rank(value) == _rank(other) and test(_sort_key(value), _sort_key(other))
+
+
+def _is_operators(condition) -> bool:
+    return isinstance(condition, dict) and len(condition) > 0 and all(key.startswith("$") for key in condition)
+
+
+def _compile_in(values: list):
+    '''
+        Membership test of a $in, with a set when the values allow it
+    '''
+    try:
+        members = {(_rank(value), _hashable(value)) for value in values}
+    except TypeError:
+        return lambda value: any(_equal(value, other) for other in values)
+
+    def test(value):
+        if value is MISSING:
+            return (0, None) in members
+        if isinstance(value, list) and (_rank(value), _hashable(value)) not in members:
+            return any(test(item) for item in value)
+        return (_rank(value), _hashable(value)) in members
+    return test
+
+
+def _compile_field(condition):
+    '''
+        Test of the value of a field (MISSING if it isn't in the document)
+    '''
+    if not _is_operators(condition):
+        return lambda value: _equal(value, condition)
+
+    tests = []
+    for operator, argument in condition.items():
+        match operator:
+            case "$eq":
+                tests.append(lambda value, argument=argument: _equal(value, argument))
+            case "$ne":
+                tests.append(lambda value, argument=argument: not _equal(value, argument))
+            case "$lt":
+                tests.append(lambda value, argument=argument: _compare(value, argument, tuple.__lt__))
+            case "$lte":
+                tests.append(lambda value, argument=argument: _compare(value, argument, tuple.__le__))
+            case "$gt":
+                tests.append(lambda value, argument=argument: _compare(value, argument, tuple.__gt__))
+            case "$gte":
+                tests.append(lambda value, argument=argument: _compare(value, argument, tuple.__ge__))
+            case "$in":
+                tests.append(_compile_in(argument))
+            case "$nin":
+                member = _compile_in(argument)
+                tests.append(lambda value, member=member: not member(value))
+            case "$exists":
+                tests.append(lambda value, argument=argument: (value is not MISSING) == bool(argument))
+            case "$size":
+                tests.append(lambda value, argument=argument: isinstance(value, list) and len(value) == argument)
+            case _:
+                raise ValueError("Unsupported query operator " + operator)
+    return lambda value: all(test(value) for test in tests)
+
+
+def compile_filter(filter: dict | None):
+    '''
+        Function telling if a document matches the filter
+    '''
+    if not filter:
+        return lambda document: True
+
+    tests = []
+    for field, condition in filter.items():
+        match field:
+            case "$and":
+                clauses = [compile_filter(clause) for clause in condition]
+                tests.append(lambda document, clauses=clauses: all(clause(document) for clause in clauses))
+            case "$or":
+                clauses = [compile_filter(clause) for clause in condition]
+                tests.append(lambda document, clauses=clauses: any(clause(document) for clause in clauses))
+            case _:
+                test = _compile_field(condition)
+                tests.append(lambda document, field=field, test=test: test(document.get(field, MISSING)))
+    return lambda document: all(test(document) for test in tests)
+
+
+def project(document: dict, projection: dict | None) -> dict:
+    if not projection:
+        return dict(document)
+    if not any(projection.values()):
+        return {field: value for field, value in document.items()
+                if projection.get(field, 1)}
+    included = [field for field, flag in projection.items() if flag and field != "_id"]
+    result = {}
+    if projection.get("_id", 1):
+        result["_id"] = document["_id"]
+    for field in included:
+        if field in document:
+            result[field] = document[field]
+    return result
+
+
+def apply_update(document: dict, update: dict) -> dict:
+    '''
+        The updated copy of the document, the document isn't changed
+    '''
+    updated = dict(document)
+    for operator, fields in update.items():
+        for field, argument in fields.items():
+            match operator:
+                case "$set":
+                    updated[field] = argument
+                case "$unset":
+                    updated.pop(field, None)
+                case "$inc":
+                    updated[field] = updated.get(field, 0) + argument
+                case "$push":
+                    items = argument["$each"] if isinstance(argument, dict) and "$each" in argument else [argument]
+                    updated[field] = list(updated.get(field, [])) + list(items)
+                case "$addToSet":
+                    items = argument["$each"] if isinstance(argument, dict) and "$each" in argument else [argument]
+                    values = list(updated.get(field, []))
+                    present = {(_rank(value), _hashable(value)) for value in values}
+                    for item in items:
+                        key = (_rank(item), _hashable(item))
+                        if key not in present:
+                            present.add(key)
+                            values.append(item)
+                    updated[field] = values
+                case "$pull":
+                    test = _compile_field(argument)
+                    updated[field] = [value for value in updated.get(field, []) if not test(value)]
+                case _:
+                    raise ValueError("Unsupported update operator " + operator)
+    return updated
+
+
+class Index:
+    '''
+        Secondary index: value of the fields -> ids of the documents
+    '''
+
+    __slots__ = ('name', 'fields', 'unique', 'ids')
+
+    def __init__(self, name: str, fields: list, unique: bool):
+        self.name = name
+        self.fields = fields
+        self.unique = unique
+        self.ids = {}
+
+    def key(self, document: dict):
+        if len(self.fields) == 1:
+            value = document.get(self.fields[0])
+            return _rank(value), _hashable(value)
+        return tuple((_rank(value), _hashable(value))
+                     for value in (document.get(field) for field in self.fields))
+
+    def check(self, document: dict):
+        if not self.unique:
+            return
+        ids = self.ids.get(self.key(document))
+        if ids and (len(ids) > 1 or document["_id"] not in ids):
+            raise DuplicateKeyError("E11000 duplicate key error, index: " + self.name)
+
+    def add(self, document: dict):
+        self.ids.setdefault(self.key(document), set()).add(document["_id"])
+
+    def remove(self, document: dict):
+        key = self.key(document)
+        ids = self.ids.get(key)
+        if ids is not None:
+            ids.discard(document["_id"])
+            if not ids:
+                del self.ids[key]
+
+    def info(self) -> dict:
+        info = {"key": [(field, 1) for field in self.fields], "v": 2}
+        if self.unique:
+            info["unique"] = True
+        return info
+
+
+class Cursor:
+    '''
+        The documents of the ids matching the filter, read while iterating
+    '''
+
+    def __init__(self, documents: dict, ids, match, projection):
+        self.__documents = documents
+        self.__ids = iter(ids)
+        self.__match = match
+        self.__projection = projection
+
+    def batch_size(self, _):
+        return self
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> dict:
+        for id in self.__ids:
+            document = self.__documents.get(id)
+            if document is not None and self.__match(document):
+                return project(document, self.__projection)
+        raise StopIteration
+
+
+class LocalCollection:
+
+    def __init__(self, path: str, name: str):
+        self.name = name
+        self.__path = os.path.join(path, name)
+        self.__lock = threading.RLock()
+        self.__documents = None
+        # like in MongoDB, reading a collection doesn't create it
+        self.__created = False
+        self.__indexes = {}
+        self.__log = None
+        self.__log_records = 0
+        # sorted (rank, id) of the ids, the new ids wait in pending,
+        # the deleted ones stay until there are too many of them
+        self.__keys = None
+        self.__pending = []
+        self.__stale = set()
+
+    # state
+
+    @property
+    def exists(self) -> bool:
+        with self.__lock:
+            if self.__documents is not None:
+                return self.__created
+            return os.path.exists(self.__path + SNAPSHOT) or os.path.exists(self.__path + LOG)
+
+    def __load(self) -> dict:
+        with self.__lock:
+            if self.__documents is not None:
+                return self.__documents
+            documents = {}
+            definitions = {}
+            for file in (self.__path + SNAPSHOT, self.__path + LOG):
+                for record in self.__read(file):
+                    if "put" in record:
+                        documents[record["put"]["_id"]] = record["put"]
+                    elif "delete" in record:
+                        documents.pop(record["delete"], None)
+                    elif "index" in record:
+                        definitions[record["index"]] = record
+                    if file.endswith(LOG):
+                        self.__log_records += 1
+            self.__documents = documents
+            self.__created = os.path.exists(self.__path + SNAPSHOT) or os.path.exists(self.__path + LOG)
+            for definition in definitions.values():
+                index = Index(definition["index"], definition["fields"], definition["unique"])
+                for document in documents.values():
+                    index.add(document)
+                self.__indexes[index.name] = index
+            return documents
+
+    @staticmethod
+    def __read(file: str):
+        '''
+            Records of a file, a record cut by a crash is dropped
+        '''
+        if not os.path.exists(file):
+            return
+        with open(file, "rb") as f:
+            data = f.read()
+        offset = 0
+        while offset + LENGTH_SIZE <= len(data):
+            length = int.from_bytes(data[offset:offset + LENGTH_SIZE], "little")
+            if length < 5 or offset + length > len(data):
+                break
+            try:
+                record = bson.decode(data[offset:offset + length])
+            except bson.errors.InvalidBSON:
+                break
+            offset += length
+            yield record
+        if offset != len(data):
+            with open(file, "r+b") as f:
+                f.truncate(offset)
+
+    def __write(self, records: list):
+        if not records:
+            return
+        if self.__log is None:
+            os.makedirs(os.path.dirname(self.__path), exist_ok=True)
+            self.__log = open(self.__path + LOG, "ab")
+            self.__created = True
+        self.__log.write(b"".join(bson.encode(record) for record in records))
+        self.__log.flush()
+        self.__log_records += len(records)
+        if self.__log_records > max(COMPACT_MIN, len(self.__documents)):
+            self.__compact()
+
+    def __compact(self):
+        '''
+            Writes the snapshot of the collection, then empties the log
+        '''
+        temporary = self.__path + SNAPSHOT + ".tmp"
+        with open(temporary, "wb") as f:
+            for index in self.__indexes.values():
+                f.write(bson.encode({"index": index.name, "fields": index.fields, "unique": index.unique}))
+            for document in self.__documents.values():
+                f.write(bson.encode({"put": document}))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, self.__path + SNAPSHOT)
+        if self.__log is not None:
+            self.__log.close()
+        self.__log = open(self.__path + LOG, "wb")
+        self.__log_records = 0
+
+    def create(self):
+        with self.__lock:
+            self.__load()
+            if not os.path.exists(self.__path + SNAPSHOT):
+                os.makedirs(os.path.dirname(self.__path), exist_ok=True)
+                open(self.__path + SNAPSHOT, "wb").close()
+            self.__created = True
+
+    def drop(self):
+        with self.__lock:
+            if self.__log is not None:
+                self.__log.close()
+                self.__log = None
+            for file in (self.__path + SNAPSHOT, self.__path + LOG):
+                if os.path.exists(file):
+                    os.remove(file)
+            self.__documents = None
+            self.__created = False
+            self.__indexes = {}
+            self.__log_records = 0
+            self.__keys = None
+            self.__pending = []
+            self.__stale = set()
+
+    def close(self):
+        with self.__lock:
+            if self.__log is not None:
+                self.__log.close()
+                self.__log = None
+
+    def sync(self):
+        with self.__lock:
+            if self.__log is not None:
+                os.fsync(self.__log.fileno())
+
+    # reading
+
+    def __sorted_keys(self) -> list:
+        documents = self.__documents
+        if self.__keys is None or len(self.__stale) > len(self.__keys) // 2:
+            self.__keys = sorted(_sort_key(id) for id in documents)
+            self.__pending = []
+            self.__stale = set()
+        elif self.__pending:
+            if len(self.__pending) <= MERGE_ONE_BY_ONE:
+                for id in self.__pending:
+                    insort(self.__keys, _sort_key(id))
+            else:
+                self.__keys = sorted(self.__keys + [_sort_key(id) for id in self.__pending])
+            self.__pending = []
+        return self.__keys
+
+    def __id_range(self, condition: dict):
+        '''
+            Ids matching a range of _id, None if it isn't a range
+        '''
+        bounds = [value for operator, value in condition.items() if operator in ("$lt", "$lte", "$gt", "$gte")]
+        if len(bounds) != len(condition) or len({_rank(value) for value in bounds}) != 1:
+            return None
+        rank = _rank(bounds[0])
+        keys = self.__sorted_keys()
+        low, high = 0, len(keys)
+        for operator, value in condition.items():
+            match operator:
+                case "$gt":
+                    low = max(low, bisect_right(keys, _sort_key(value)))
+                case "$gte":
+                    low = max(low, bisect_left(keys, _sort_key(value)))
+                case "$lt":
+                    high = min(high, bisect_left(keys, _sort_key(value)))
+                case "$lte":
+                    high = min(high, bisect_right(keys, _sort_key(value)))
+        low = max(low, bisect_left(keys, (rank,)))
+        high = min(high, bisect_left(keys, (rank + 1,)))
+        stale = self.__stale
+        return [key[1] for key in keys[low:high] if key[1] not in stale]
+
+    def __candidates(self, filter: dict | None):
+        '''
+            Ids of the documents that can match the filter
+        '''
+        documents = self.__documents
+        if not filter:
+            return list(documents)
+
+        for field, condition in filter.items():
+            if field == "$and":
+                for clause in condition:
+                    ids = self.__candidates(clause)
+                    if len(ids) < len(documents):
+                        return ids
+                continue
+            if field.startswith("$"):
+                continue
+
+            if _is_operators(condition):
+                values = condition.get("$in", MISSING)
+                if "$eq" in condition:
+                    values = [condition["$eq"]]
+            else:
+                values = [condition]
+
+            if field == "_id":
+                if values is not MISSING:
+                    return [value for value in dict.fromkeys(_hashable(value) for value in values)
+                            if value in documents]
+                if _is_operators(condition):
+                    ids = self.__id_range(condition)
+                    if ids is not None:
+                        return ids
+                continue
+
+            if values is MISSING:
+                continue
+            for index in self.__indexes.values():
+                if index.fields == [field]:
+                    ids = set()
+                    for value in values:
+                        ids |= index.ids.get((_rank(value), _hashable(value)), set())
+                    return list(ids)
+        return list(documents)
+
+    def find(self, filter: dict = None, projection: dict = None, batch_size: int = 0):
+        match = compile_filter(filter)
+        with self.__lock:
+            self.__load()
+            ids = self.__candidates(filter)
+            return Cursor(self.__documents, ids, match, projection)
+
+    def find_one(self, filter: dict = None, projection: dict = None):
+        return next(self.find(filter, projection), None)
+
+    def estimated_document_count(self) -> int:
+        with self.__lock:
+            return len(self.__load())
+
+    def count_documents(self, filter: dict) -> int:
+        return sum(1 for _ in self.find(filter, {"_id": 1}))
+
+    def aggregate(self, pipeline: list) -> list:
+        documents = list(self.find())
+        for stage in pipeline:
+            (operator, argument), = stage.items()
+            match operator:
+                case "$match":
+                    match = compile_filter(argument)
+                    documents = [document for document in documents if match(document)]
+                case "$project":
+                    documents = [self.__project_stage(document, argument) for document in documents]
+                case "$sort":
+                    for field, direction in reversed(list(argument.items())):
+                        documents.sort(key=lambda document: _sort_key(document.get(field)),
+                                       reverse=direction < 0)
+                case _:
+                    raise ValueError("Unsupported aggregation stage " + operator)
+        return documents
+
+    @staticmethod
+    def __project_stage(document: dict, projection: dict) -> dict:
+        result = {"_id": document["_id"]} if projection.get("_id", 1) else {}
+        for field, expression in projection.items():
+            if field == "_id":
+                continue
+            if isinstance(expression, dict) and "$size" in expression:
+                result[field] = len(document.get(expression["$size"].lstrip("$"), []))
+            elif expression and field in document:
+                result[field] = document[field]
+        return result
+
+    def index_information(self) -> dict:
+        with self.__lock:
+            self.__load()
+            information = {"_id_": {"key": [("_id", 1)], "v": 2}}
+            for index in self.__indexes.values():
+                information[index.name] = index.info()
+            return information
+
+    # writing
+
+    def __put(self, document: dict, old: dict | None):
+        '''
+            Stores the new version of a document, the unique indexes
+            are checked before anything is changed
+        '''
+        for index in self.__indexes.values():
+            index.check(document)
+        id = document["_id"]
+        if old is not None:
+            for index in self.__indexes.values():
+                index.remove(old)
+        elif self.__keys is not None:
+            if id in self.__stale:
+                self.__stale.discard(id)
+            else:
+                self.__pending.append(id)
+        for index in self.__indexes.values():
+            index.add(document)
+        self.__documents[id] = document
+
+    def __remove(self, id):
+        document = self.__documents.pop(id)
+        for index in self.__indexes.values():
+            index.remove(document)
+        if self.__keys is not None:
+            self.__stale.add(id)
+
+    def __run(self, operations: list, ordered: bool):
+        '''
+            operations are functions doing one write, returning the records
+            of the log, the first error is raised once the others are done
+            (or right away if ordered)
+        '''
+        records = []
+        error = None
+        with self.__lock:
+            self.__load()
+            try:
+                for operation in operations:
+                    try:
+                        records += operation()
+                    except DuplicateKeyError as e:
+                        if ordered:
+                            raise
+                        error = error or e
+            finally:
+                self.__write(records)
+        if error is not None:
+            raise error
+
+    def insert_many(self, documents: list, ordered: bool = True):
+        def insert(document):
+            def operation():
+                if "_id" not in document:
+                    document["_id"] = bson.ObjectId()
+                if document["_id"] in self.__documents:
+                    raise DuplicateKeyError("E11000 duplicate key error, _id: " + str(document["_id"]))
+                self.__put(document, None)
+                return [{"put": document}]
+            return operation
+
+        self.__run([insert(dict(document)) for document in documents], ordered)
+
+    def insert_one(self, document: dict):
+        self.insert_many([document])
+
+    def __update(self, filter: dict, update, upsert: bool, replace: bool):
+        def operation():
+            old = self.find_one(filter)
+            if old is None:
+                if not upsert:
+                    return []
+                old = {field: value for field, value in filter.items()
+                       if not field.startswith("$") and not _is_operators(value)}
+                if "_id" not in old:
+                    old["_id"] = bson.ObjectId()
+                current = None
+            else:
+                current = self.__documents[old["_id"]]
+            if replace:
+                document = dict(update)
+                document["_id"] = old["_id"]
+            else:
+                document = apply_update(old, update)
+            self.__put(document, current)
+            return [{"put": document}]
+        return operation
+
+    def update_one(self, filter: dict, update: dict, upsert: bool = False):
+        self.__run([self.__update(filter, update, upsert, False)], True)
+
+    def replace_one(self, filter: dict, replacement: dict, upsert: bool = False):
+        self.__run([self.__update(filter, replacement, upsert, True)], True)
+
+    def __delete(self, filter: dict, many: bool):
+        def operation():
+            ids = [document["_id"] for document in self.find(filter, {"_id": 1})]
+            if not many:
+                ids = ids[:1]
+            for id in ids:
+                self.__remove(id)
+            return [{"delete": id} for id in ids]
+        return operation
+
+    def delete_one(self, filter: dict):
+        self.__run([self.__delete(filter, False)], True)
+
+    def delete_many(self, filter: dict):
+        self.__run([self.__delete(filter, True)], True)
+
+    def bulk_write(self, requests: list, ordered: bool = True):
+        operations = []
+        for request in requests:
+            if isinstance(request, UpdateOne):
+                operations.append(self.__update(request.filter, request.update, request.upsert, False))
+            elif isinstance(request, ReplaceOne):
+                operations.append(self.__update(request.filter, request.replacement, request.upsert, True))
+            else:
+                raise ValueError("Unsupported bulk write request " + type(request).__name__)
+        self.__run(operations, ordered)
+
+    def create_index(self, key, unique: bool = False, name: str = None) -> str:
+        fields = [key] if isinstance(key, str) else [field for field, _ in key]
+        name = name or "_".join(field + "_1" for field in fields)
+        with self.__lock:
+            documents = self.__load()
+            if name in self.__indexes:
+                return name
+            index = Index(name, fields, unique)
+            for document in documents.values():
+                index.check(document)
+                index.add(document)
+            self.__indexes[name] = index
+            self.__write([{"index": name, "fields": fields, "unique": unique}])
+        return name
+
+
+class LocalDatabase:
+
+    def __init__(self, path: str, name: str):
+        self.name = name
+        self.path = os.path.join(path, name)
+        self.__collections = {}
+        self.__lock = threading.Lock()
+
+    def __getitem__(self, name: str) -> LocalCollection:
+        with self.__lock:
+            collection = self.__collections.get(name)
+            if collection is None:
+                collection = self.__collections[name] = LocalCollection(self.path, name)
+            return collection
+
+    def list_collection_names(self) -> list:
+        names = set()
+        if os.path.isdir(self.path):
+            for file in os.listdir(self.path):
+                for suffix in (SNAPSHOT, LOG):
+                    if file.endswith(suffix):
+                        names.add(file[:-len(suffix)])
+        with self.__lock:
+            collections = list(self.__collections.values())
+        names.update(collection.name for collection in collections if collection.exists)
+        return sorted(name for name in names if self[name].exists)
+
+    def create_collection(self, name: str) -> LocalCollection:
+        collection = self[name]
+        collection.create()
+        return collection
+
+    def drop_collection(self, name: str):
+        self[name].drop()
+
+    def sync(self):
+        with self.__lock:
+            collections = list(self.__collections.values())
+        for collection in collections:
+            collection.sync()
+
+    def drop(self):
+        with self.__lock:
+            collections = list(self.__collections.values())
+            self.__collections = {}
+        for collection in collections:
+            collection.drop()
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+class LocalClient:
+    '''
+        The databases are the directories of path
+    '''
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.__databases = {}
+        self.__lock = threading.Lock()
+
+    def __getitem__(self, name: str) -> LocalDatabase:
+        with self.__lock:
+            database = self.__databases.get(name)
+            if database is None:
+                database = self.__databases[name] = LocalDatabase(self.path, name)
+            return database
+
+    def list_database_names(self) -> list:
+        names = [name for name in os.listdir(self.path)
+                 if os.path.isdir(os.path.join(self.path, name))]
+        return sorted(name for name in names if self[name].list_collection_names())
+
+    def list_databases(self) -> list:
+        return [{"name": name} for name in self.list_database_names()]
+
+    def drop_database(self, name: str):
+        self[name].drop()
+
+    def sync(self):
+        '''
+            The writes are flushed to the files, this syncs them to the disk
+        '''
+        with self.__lock:
+            databases = list(self.__databases.values())
+        for database in databases:
+            database.sync()
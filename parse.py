@@ -4,6 +4,11 @@
 
 from type_def import Types
 
+# ADD INDEX table column [USING kind], the index tables are the default
+INDEX_KINDS = ('btree', 'bitmap')
+# ADD INDEX table column column... [USING btree], the composite indexes are B+trees
+COMPOSITE_INDEX_KINDS = ('btree',)
+
 
 def match_token(token: str) -> Types | str:
     match token:
@@ -45,6 +50,16 @@ def match_token(token: str) -> Types | str:
             return Types.ALL
         case 'select':
             return Types.SELECT
+        case 'migrate':
+            return Types.MIGRATE
+        case 'analyze':
+            return Types.ANALYZE
+        case 'explain':
+            return Types.EXPLAIN
+        case 'prepare':
+            return Types.PREPARE
+        case 'execute':
+            return Types.EXECUTE
 
         # operators
         case '=' | '==':
@@ -85,9 +100,19 @@ def tokenize(commands: str) -> list:
 
     stripped = map(lambda token: token.lower().strip(', ()\t\n\r\'"'),
                    command_list)
-    tokenized = map(lambda token: match_token(token), stripped)
+    tokenized = list(map(lambda token: match_token(token), stripped))
+
+    # INSERT ... VALUES (a, b), (c, d): a ROW separates the rows
+    if Types.VALUES in tokenized:
+        start = tokenized.index(Types.VALUES) + 1
+        marked = tokenized[:start + 1]
+        for raw, token in zip(command_list[start + 1:], tokenized[start + 1:]):
+            if raw.startswith('('):
+                marked.append(Types.ROW)
+            marked.append(token)
+        tokenized = marked
 
-    return list(tokenized)
+    return tokenized
 
 
 def parse(list_of_commands: list) -> bool:
@@ -110,8 +135,15 @@ def parse(list_of_commands: list) -> bool:
             return isinstance(table, str)
         case [Types.ADD, Types.INDEX, table, col]:
             return isinstance(table, str) and isinstance(col, str)
+        case [Types.ADD, Types.INDEX, table, col, 'using', kind]:
+            return isinstance(table, str) and isinstance(col, str) and kind in INDEX_KINDS
+        case [Types.ADD, Types.INDEX, table, *cols, 'using', kind]:
+            return isinstance(table, str) and check_composite_index_args(cols) \
+                and kind in COMPOSITE_INDEX_KINDS
+        case [Types.ADD, Types.INDEX, table, *cols]:
+            return isinstance(table, str) and check_composite_index_args(cols)
         case [Types.INSERT, Types.INTO, table, Types.VALUES, *args]:
-            return isinstance(table, str) and len(args) != 0
+            return isinstance(table, str) and check_insert_args(args)
         case [Types.DELETE, Types.FROM, table, Types.WHERE, id]:
             return isinstance(table, str) and isinstance(id, str)
         case [Types.ADD, Types.PK, table, col]:
@@ -121,6 +153,16 @@ def parse(list_of_commands: list) -> bool:
                     and isinstance(table2, str) and isinstance(col2, str))
         case [Types.ADD, Types.UQ, table, col]:
             return isinstance(table, str) and isinstance(col, str)
+        case [Types.MIGRATE, Types.TABLE, table]:
+            return isinstance(table, str)
+        case [Types.ANALYZE, table]:
+            return isinstance(table, str)
+        case [Types.EXPLAIN, Types.ANALYZE, Types.SELECT, *_] | [Types.EXPLAIN, Types.SELECT, *_]:
+            return parse(list_of_commands[list_of_commands.index(Types.SELECT):])
+        case [Types.PREPARE, name, 'as', Types.SELECT | Types.INSERT, *_]:
+            return isinstance(name, str) and parse(list_of_commands[3:])
+        case [Types.EXECUTE, name, *values]:
+            return isinstance(name, str) and all(isinstance(value, str) for value in values)
         case [Types.SELECT, Types.ALL, Types.FROM, table] if\
                 isinstance(table, str):
             return True
@@ -133,21 +175,83 @@ def parse(list_of_commands: list) -> bool:
 
 
 def check_select_all_args(args: list) -> bool:
-    prev = True
-    for idx, val in enumerate(args):
-        if idx % 2:
-            if prev and val not in (Types.EQ, Types.LE, Types.GT,
-                                    Types.LE, Types.GE, Types.NE):
-                return False
+    '''
+        table WHERE column operator value [AND column operator value]...
+        OR isn't supported, the conditions are all ANDed
+    '''
+    if len(args) > 1 and isinstance(args[1], str):
+        return check_join_args(args)
 
-            if not prev and val not in (Types.AND, Types.OR):
-                return False
+    if len(args) < 5 or not isinstance(args[0], str) or args[1] != Types.WHERE:
+        return False
 
-            prev = not prev
+    conditions = args[2:]
+    if len(conditions) % 4 != 3:
+        return False
+
+    for idx, val in enumerate(conditions):
+        match idx % 4:
+            case 0 | 2:
+                if not isinstance(val, str):
+                    return False
+            case 1:
+                if val not in (Types.EQ, Types.LT, Types.GT,
+                               Types.LE, Types.GE, Types.NE):
+                    return False
+            case 3:
+                if val not in (Types.AND, 'and'):
+                    return False
 
     return True
 
 
+def check_join_args(args: list) -> bool:
+    '''
+        table alias [INNER] JOIN table alias ON a.column = b.column ...
+        [WHERE conditions]
+    '''
+    if not isinstance(args[0], str):
+        return False
+
+    cursor = 2
+    joins = 0
+    while cursor < len(args) and args[cursor] != Types.WHERE:
+        if args[cursor] == 'inner':
+            cursor += 1
+        match args[cursor:cursor + 7]:
+            case ['join', str(), str(), 'on', str(), Types.EQ, str()]:
+                cursor += 7
+                joins += 1
+            case _:
+                return False
+
+    if joins == 0:
+        return False
+    if cursor == len(args):
+        return True
+    return check_select_all_args(args[:1] + args[cursor:])
+
+
+def split_rows(args: list) -> list:
+    '''
+        The values of an INSERT, as a list of rows
+    '''
+    rows = [[]]
+    for arg in args:
+        if arg == Types.ROW:
+            rows.append([])
+        else:
+            rows[-1].append(arg)
+    return rows
+
+
+def check_insert_args(args: list) -> bool:
+    rows = split_rows(args)
+    if len(rows[0]) == 0:
+        return False
+    return all(len(row) == len(rows[0]) for row in rows)
+
+
 def check_select_args(args: list) -> bool:
     return True
         
@@ -211,3 +315,11 @@ def check_create_table_args(args: list) -> bool:
         cursor += 2
 
     return True
+
+
+def check_composite_index_args(args: list) -> bool:
+    '''
+        At least two columns, none of them repeated
+    '''
+    return len(args) > 1 and all(isinstance(arg, str) for arg in args) and 'using' not in args \
+        and len(set(args)) == len(args)
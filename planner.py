@@ -0,0 +1,172 @@
+'''
+    Chooses how the rows of a table matching the WHERE conditions are found
+    the access paths are the full scan, a lookup in the primary key, in an
+    index table or in a bitmap index, a range of a composite index, and the
+    intersection of the ids given by several of them.
+    Their cost is estimated from the number of rows and of distinct values,
+    the cheapest one is used
+'''
+
+import math
+
+import datatypes
+from type_def import Types
+
+# estimated cost of the work done for one row / one index entry
+SCAN_COST = 1.0
+FETCH_COST = 4.0
+INDEX_ENTRY_COST = 1.0
+ID_COST = 0.1
+# the ids of a bitmap index are ANDed a word of positions at a time
+BITMAP_ID_COST = ID_COST / 64
+
+# selectivity of a range condition when nothing better is known
+RANGE_SELECTIVITY = 1 / 3
+
+
+def prefix(columns: tuple, conditions: dict) -> list:
+    '''
+        The leading columns of a composite index whose conditions it answers,
+        the ones compared with = and the column after them
+    '''
+    covered = []
+    for column in columns:
+        conds = conditions.get(column)
+        if not conds:
+            break
+        covered.append(column)
+        if any(Types(int(cond[0])) != Types.EQ for cond in conds):
+            break
+    return covered
+
+
+class Plan:
+    '''
+        columns are the ones whose ids are read from the primary key or from
+        the index tables, from the most selective one, the conditions of
+        the other columns are checked on the fetched rows
+        no columns means a full scan
+        composite is the composite index read first, for the conditions of
+        the covered prefix of its columns
+    '''
+
+    __slots__ = ('columns', 'rows', 'cost', 'composite', 'covered')
+
+    def __init__(self, columns: list, rows: float, cost: float,
+                 composite: tuple = None, covered: list = ()):
+        self.columns = columns
+        self.rows = rows
+        self.cost = cost
+        self.composite = composite
+        self.covered = list(covered)
+
+    @property
+    def kind(self) -> str:
+        if not self.columns:
+            return "scan"
+        if self.composite is not None and len(self.columns) == len(self.covered):
+            return "composite"
+        if len(self.columns) > 1:
+            return "intersection"
+        return "index"
+
+
+class Planner:
+    '''
+        rows is the number of rows of the table,
+        distinct maps the indexed columns to their number of distinct values
+        (the size of their index table), the primary key has one for every row
+        stats are the TableStats of the last ANALYZE, if there was one
+    '''
+
+    def __init__(self, schema, rows: int, distinct: dict, stats=None):
+        self.schema = schema
+        self.rows = max(rows, 1)
+        self.distinct = dict(distinct)
+        self.distinct[schema.pk.name] = self.rows
+        self.stats = stats
+
+    def selectivity(self, column: str, conditions: list) -> float:
+        '''
+            Estimated fraction of the rows matching every condition of
+            the column, the conditions are taken as independent
+        '''
+        if self.stats is not None and column in self.stats.columns:
+            col = self.schema.column(column)
+            return self.stats.columns[column].selectivity(
+                [(Types(int(cond[0])), datatypes.convert(cond[1], col.type)) for cond in conditions])
+
+        distinct = max(self.distinct.get(column, self.rows), 1)
+        selectivity = 1.0
+        for cond in conditions:
+            match Types(int(cond[0])):
+                case Types.EQ:
+                    selectivity *= 1 / distinct
+                case Types.NE:
+                    selectivity *= 1 - 1 / distinct
+                case _:
+                    selectivity *= RANGE_SELECTIVITY
+        return selectivity
+
+    def entries(self, column: str, conditions: list) -> float:
+        '''
+            Estimated number of index entries (distinct values) read
+        '''
+        distinct = max(self.distinct.get(column, self.rows), 1)
+        return max(distinct * self.selectivity(column, conditions), 1.0)
+
+    def composite_entries(self, columns: list, conditions: dict, ids: float) -> float:
+        '''
+            Estimated number of composite values read, at most one for every id
+        '''
+        values = math.prod(self.entries(column, conditions[column]) for column in columns)
+        return max(min(values, ids), 1.0)
+
+    def plan(self, conditions: dict) -> Plan:
+        '''
+            conditions maps the columns to their [operator, value, type] list
+        '''
+        best = Plan([], self.rows, self.rows * SCAN_COST)
+
+        candidates = []
+        for column, conds in conditions.items():
+            col = self.schema.column(column)
+            if col.position == 1 or col.index_ready:
+                candidates.append((self.selectivity(column, conds), column))
+        candidates.sort()
+
+        # (columns, selectivity, cost) of the composite index ranges
+        starts = [(None, [], 1.0, 0.0)]
+        for composite in self.schema.composite_indexes:
+            covered = prefix(composite, conditions)
+            if not covered:
+                continue
+            selectivity = math.prod(self.selectivity(column, conditions[column]) for column in covered)
+            ids = self.rows * selectivity
+            starts.append((composite, covered, selectivity,
+                           self.composite_entries(covered, conditions, ids) * INDEX_ENTRY_COST + ids * ID_COST))
+
+        for composite, covered, selectivity, read_cost in starts:
+            columns = list(covered)
+            if columns:
+                rows = self.rows * selectivity
+                plan = Plan(list(columns), rows, read_cost + rows * FETCH_COST, composite, covered)
+                if plan.cost < best.cost:
+                    best = plan
+
+            # the ids of the most selective columns, intersected one by one
+            for column_selectivity, column in candidates:
+                if column in covered:
+                    continue
+                ids = self.rows * column_selectivity
+                col = self.schema.column(column)
+                id_cost = BITMAP_ID_COST if col.position != 1 and col.index_kind == "bitmap" else ID_COST
+                read_cost += self.entries(column, conditions[column]) * INDEX_ENTRY_COST + ids * id_cost
+                selectivity *= column_selectivity
+                columns.append(column)
+
+                rows = self.rows * selectivity
+                plan = Plan(list(columns), rows, read_cost + rows * FETCH_COST, composite, covered)
+                if plan.cost < best.cost:
+                    best = plan
+        return best
@@ -0,0 +1,256 @@
+'''
+    Bucketed posting lists of the index tables
+    index_<table>_<column> keeps a key document for every value:
+        {_id: value, count: live ids, entries: entries in the buckets, generation}
+    index_<table>_<column>.buckets keeps the entries of the values in buckets
+    of at most BUCKET_SIZE entries: {key: value, generation, number, entries}
+    An insert appends the ids to the last bucket of the value, a delete appends
+    a {"deleted": id} tombstone, so a write never rewrites a whole posting list.
+    The ids of a value are the ones left after reading its entries in order.
+    The compaction writes the live ids of a value into the buckets of a new
+    generation, switches the key document to it, then deletes the old buckets,
+    a reader missing the buckets of a key document reads the value again.
+    The values having more dead entries than live ids are compacted
+    in the background.
+'''
+
+import queue
+import threading
+
+import predicate
+import storage
+
+BUCKETS = ".buckets"
+BUCKET_SIZE = 1000
+# times a value compacted while it's read is read again
+READ_RETRIES = 3
+
+
+def index_table_name(table: str, column: str) -> str:
+    return "index_" + table + "_" + column
+
+
+def _live(buckets: list) -> set:
+    '''
+        The ids of the entries of the buckets, in the order of the buckets
+    '''
+    ids = set()
+    for bucket in sorted(buckets, key=lambda bucket: bucket["number"]):
+        for entry in bucket["entries"]:
+            if isinstance(entry, dict):
+                ids.discard(entry["deleted"])
+            else:
+                ids.add(entry)
+    return ids
+
+
+class PostingTable:
+
+    def __init__(self, keys, buckets):
+        self.keys = keys
+        self.buckets = buckets
+
+    @staticmethod
+    def of(db, table: str, column: str):
+        name = index_table_name(table, column)
+        return PostingTable(db[name], db[name + BUCKETS])
+
+    def create(self):
+        self.buckets.create_index("key", name="key")
+
+    # writing
+
+    @staticmethod
+    def __append(value, generation: int, entries: int, new: list) -> list:
+        '''
+            The pushes of the new entries, filling the last bucket first
+        '''
+        requests = []
+        start = 0
+        while start < len(new):
+            number, used = divmod(entries + start, BUCKET_SIZE)
+            end = start + BUCKET_SIZE - used
+            requests.append(storage.UpdateOne(
+                {"key": value, "generation": generation, "number": number},
+                {"$push": {"entries": {"$each": new[start:end]}}}, upsert=True))
+            start = end
+        return requests
+
+    def insert(self, pairs: list, exact: bool = False):
+        '''
+            pairs are (value, id) of the inserted rows, exact skips the ids
+            already in the posting lists (the redo of the write-ahead log)
+        '''
+        ids_for_value = {}
+        for value, id in pairs:
+            ids_for_value.setdefault(value, []).append(id)
+        keys = self.__keys(list(ids_for_value))
+        if exact:
+            live = self.__ids(keys)
+            ids_for_value = {value: [id for id in ids if id not in live.get(value, ())]
+                             for value, ids in ids_for_value.items()}
+
+        appends = []
+        updates = []
+        for value, ids in ids_for_value.items():
+            if not ids:
+                continue
+            key = keys.get(value)
+            generation, entries = (key["generation"], key["entries"]) if key is not None else (0, 0)
+            appends += self.__append(value, generation, entries, ids)
+            update = {"$inc": {"count": len(ids), "entries": len(ids)}}
+            if key is None:
+                update["$set"] = {"generation": 0}
+            updates.append(storage.UpdateOne({"_id": value}, update, upsert=True))
+        # the buckets first, a reader never misses the entries of a key document
+        if appends:
+            self.buckets.bulk_write(appends, ordered=False)
+        if updates:
+            self.keys.bulk_write(updates, ordered=False)
+
+    def delete(self, value, id, compact: bool = True, exact: bool = False) -> bool:
+        '''
+            Appends the tombstone of the id, returns True if the value
+            should be compacted. compact is False while the index is built,
+            the build compacts the values at the end
+        '''
+        key = self.keys.find_one({"_id": value})
+        if key is None:
+            return False
+        if exact and id not in self.__ids({value: key}).get(value, ()):
+            return False
+        if compact and key["count"] <= 1:
+            # the last id of the value
+            self.__remove(value)
+            return False
+        self.buckets.bulk_write(self.__append(value, key["generation"], key["entries"], [{"deleted": id}]))
+        self.keys.update_one({"_id": value}, {"$inc": {"count": -1, "entries": 1}})
+        count = key["count"] - 1
+        return compact and key["entries"] + 1 - count > max(count, BUCKET_SIZE)
+
+    def __remove(self, value):
+        self.keys.delete_one({"_id": value})
+        self.buckets.delete_many({"key": value})
+
+    def compact(self, values: list):
+        '''
+            Rewrites the live ids of the values into the buckets
+            of a new generation, the values without ids are removed
+        '''
+        keys = self.__keys(values)
+        for value, ids in self.__ids(keys).items():
+            if not ids:
+                self.__remove(value)
+                continue
+            generation = keys[value]["generation"] + 1
+            # the buckets of a compaction cut by a crash
+            self.buckets.delete_many({"key": value, "generation": {"$gte": generation}})
+            self.buckets.bulk_write(self.__append(value, generation, 0, list(ids)), ordered=False)
+            self.keys.update_one({"_id": value}, {"$set": {"generation": generation, "count": len(ids),
+                                                           "entries": len(ids)}})
+            self.buckets.delete_many({"key": value, "generation": {"$lt": generation}})
+
+    # reading
+
+    def __keys(self, values: list) -> dict:
+        return {key["_id"]: key for key in self.keys.find({"_id": {"$in": values}})}
+
+    def __ids(self, keys: dict) -> dict:
+        '''
+            value -> ids of the values of the key documents
+        '''
+        ids = {}
+        for attempt in range(READ_RETRIES):
+            buckets = {}
+            for bucket in self.buckets.find({"key": {"$in": list(keys)}}):
+                buckets.setdefault(bucket["key"], []).append(bucket)
+            moved = []
+            for value, key in keys.items():
+                current = [bucket for bucket in buckets.get(value, ())
+                           if bucket["generation"] == key["generation"]]
+                if sum(len(bucket["entries"]) for bucket in current) < key["entries"] \
+                        and attempt + 1 < READ_RETRIES:
+                    # compacted since the key document was read
+                    moved.append(value)
+                    continue
+                ids[value] = _live(current)
+            if not moved:
+                break
+            keys = self.__keys(moved)
+        return ids
+
+    def select(self, conditions: list) -> set:
+        '''
+            conditions are (operator, typed value), all of them are checked
+            on the key documents
+        '''
+        clauses = [{"_id": {predicate.MONGO_OPERATORS[operator]: value}} for operator, value in conditions]
+        query = clauses[0] if len(clauses) == 1 else {"$and": clauses}
+        keys = {key["_id"]: key for key in self.keys.find(query)}
+        ids = set()
+        for value_ids in self.__ids(keys).values():
+            ids |= value_ids
+        return ids
+
+    def lookup(self, values: list) -> list:
+        ids = []
+        for value_ids in self.__ids(self.__keys(values)).values():
+            ids += value_ids
+        return ids
+
+    def existing(self, values: list) -> set:
+        found = self.keys.find({"_id": {"$in": values}, "count": {"$gt": 0}}, {"_id": 1})
+        return {key["_id"] for key in found}
+
+    def distinct(self) -> int:
+        return self.keys.estimated_document_count()
+
+    def postings(self) -> list:
+        '''
+            (value, number of ids) in the order of the values
+        '''
+        return [(key["_id"], key["count"]) for key in self.keys.aggregate(
+            [{"$project": {"count": 1}}, {"$sort": {"_id": 1}}])]
+
+
+class Compactor:
+    '''
+        Background thread compacting the values with too many dead entries,
+        the table is locked while one of its values is compacted
+    '''
+
+    def __init__(self, client, locks):
+        self.__client = client
+        self.__locks = locks
+        self.__queue = queue.Queue()
+        self.__scheduled = set()
+        self.__lock = threading.Lock()
+        threading.Thread(target=self.__run, daemon=True).start()
+
+    def schedule(self, db: str, table: str, column: str, value):
+        task = (db, table, column, value)
+        with self.__lock:
+            if task in self.__scheduled:
+                return
+            self.__scheduled.add(task)
+        self.__queue.put(task)
+
+    def join(self):
+        '''
+            Waits for the scheduled compactions
+        '''
+        self.__queue.join()
+
+    def __run(self):
+        while True:
+            task = self.__queue.get()
+            with self.__lock:
+                self.__scheduled.discard(task)
+            db, table, column, value = task
+            try:
+                with self.__locks.tables(db, [table]):
+                    PostingTable.of(self.__client[db], table, column).compact([value])
+            except Exception as e:
+                print("Error: compaction of " + index_table_name(table, column) + " failed: " + str(e))
+            finally:
+                self.__queue.task_done()
@@ -0,0 +1,124 @@
+'''
+    Compiles the WHERE conditions of a SELECT
+    a condition is [operator, value, column type], the operator is the code
+    of a Types operator (a string, as it comes from the client)
+'''
+
+import operator
+from itertools import compress
+
+import numpy as np
+import pandas as pd
+
+import datatypes
+from type_def import Types
+
+BATCH_SIZE = 1000
+
+MONGO_OPERATORS = {
+    Types.EQ: "$eq",
+    Types.NE: "$ne",
+    Types.LT: "$lt",
+    Types.GT: "$gt",
+    Types.LE: "$lte",
+    Types.GE: "$gte",
+}
+
+OPERATOR_FUNCTIONS = {
+    Types.EQ: operator.eq,
+    Types.NE: operator.ne,
+    Types.LT: operator.lt,
+    Types.GT: operator.gt,
+    Types.LE: operator.le,
+    Types.GE: operator.ge,
+}
+
+
+def resolve(code) -> Types:
+    return Types(int(code))
+
+
+def mongo_filter(schema, columns: list, conditions: dict) -> dict:
+    '''
+        MongoDB filter checking the conditions of the columns on the server
+        only usable on tables storing typed fields
+    '''
+    clauses = []
+    for column in columns:
+        field = schema.field(column)
+        for cond in conditions[column]:
+            value = datatypes.convert(cond[1], cond[2])
+            clauses.append({field: {MONGO_OPERATORS[resolve(cond[0])]: value}})
+
+    if len(clauses) == 0:
+        return {}
+    if len(clauses) == 1:
+        return clauses[0]
+    return {"$and": clauses}
+
+
+class Predicate:
+    '''
+        Conditions evaluated in Python, on batches of documents
+        the constants are converted once, the columns of a batch are
+        compared with them as pandas Series
+    '''
+
+    def __init__(self, schema, columns: list, conditions: dict):
+        self.schema = schema
+        self.tests = []
+        for column in columns:
+            col = schema.column(column)
+            for cond in conditions[column]:
+                self.tests.append((col, OPERATOR_FUNCTIONS[resolve(cond[0])],
+                                   datatypes.convert(cond[1], col.type)))
+
+    def filter(self, documents, batch_size: int = BATCH_SIZE):
+        '''
+            Generator of the documents matching every condition
+        '''
+        batch = []
+        for document in documents:
+            batch.append(document)
+            if len(batch) == batch_size:
+                yield from self.__filter_batch(batch)
+                batch = []
+        if batch:
+            yield from self.__filter_batch(batch)
+
+    def __filter_batch(self, batch: list):
+        legacy = not self.schema.typed and all("Value" in doc for doc in batch)
+        if legacy:
+            rows = [doc["Value"].split("#") for doc in batch]
+        elif not self.schema.typed:
+            rows = [datatypes.row(self.schema, doc) for doc in batch]
+        else:
+            rows = batch
+
+        mask = np.ones(len(batch), dtype=bool)
+        columns = {}
+        for col, function, value in self.tests:
+            if col.name not in columns:
+                columns[col.name] = self.__column(batch, rows, col, legacy)
+            mask &= function(columns[col.name], value).to_numpy(dtype=bool)
+        return compress(batch, mask)
+
+    def __column(self, batch: list, rows: list, col, legacy: bool) -> pd.Series:
+        if col.position == 1:
+            return pd.Series([doc["_id"] for doc in batch])
+        if not legacy:
+            return pd.Series([row[col.name] for row in rows])
+
+        # the values are strings, they are converted for the whole batch
+        raw = pd.Series([row[col.position - 2] for row in rows])
+        match col.type:
+            case 'int' | 'bit':
+                return raw.astype(np.int64)
+            case 'float':
+                return raw.astype(np.float64)
+            case 'date':
+                return pd.to_datetime(raw, format=datatypes.DATE_FORMAT)
+            case 'datetime':
+                return pd.to_datetime(raw, format=datatypes.DATETIME_FORMAT)
+            case _:
+                return raw
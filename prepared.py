@@ -0,0 +1,95 @@
+'''
+    Prepared statements
+    a statement is parsed and checked once, then executed with new values
+    bound to its ? parameters
+'''
+
+from type_def import Types
+
+PARAMETER = '?'
+# the plan is made again once the table is this many times bigger or smaller
+REPLAN_FACTOR = 2
+
+
+class Prepared:
+    '''
+        command is the decoded statement, with ? in place of the parameters
+        schemas are the ones it was checked with, it is prepared again
+        if one of them changes
+        parsed, slots and plan are filled for SELECT statements: the result
+        of __parse_select_command, the (column, condition number) of every
+        parameter and the plan of a single table, made for plan_rows rows
+        the table had counted_rows rows when counted_writes rows were written
+        into it, the table is counted again only when the rows written since
+        can make the plan stale
+    '''
+
+    __slots__ = ('command', 'db', 'schemas', 'parameters', 'parsed', 'slots', 'plan', 'plan_rows',
+                 'counted_rows', 'counted_writes')
+
+    def __init__(self, command: list, db: str, schemas: list):
+        self.command = command
+        self.db = db
+        self.schemas = schemas
+        if command[0] == Types.INSERT:
+            self.parameters = command[2].count(PARAMETER)
+        else:
+            self.parameters = command.count(PARAMETER)
+        self.parsed = None
+        self.slots = []
+        self.plan = None
+        self.plan_rows = 0
+        self.counted_rows = 0
+        self.counted_writes = 0
+
+    def stale(self, catalog, db: str) -> bool:
+        return db != self.db or any(catalog.get(db, schema.name) is not schema
+                                    for schema in self.schemas)
+
+    def plan_stale(self, rows: int) -> bool:
+        '''
+            The table grew or shrank too much since the plan was made,
+            the plan of an empty table is a scan
+        '''
+        planned = max(self.plan_rows, 1)
+        rows = max(rows, 1)
+        return rows > planned * REPLAN_FACTOR or rows * REPLAN_FACTOR < planned
+
+    def may_be_stale(self, writes: int) -> bool:
+        '''
+            writes rows were written into the table so far, each of them
+            added or removed a row since it was counted
+        '''
+        changed = writes - self.counted_writes
+        return self.plan_stale(self.counted_rows + changed) or self.plan_stale(self.counted_rows - changed)
+
+    def counted(self, rows: int, writes: int):
+        self.counted_rows = rows
+        self.counted_writes = writes
+
+    def bind(self, values: list) -> list:
+        '''
+            The command with the values of the parameters
+        '''
+        values = iter(values)
+        return [next(values) if command == PARAMETER else command for command in self.command]
+
+    def bind_rows(self, values: list) -> list:
+        '''
+            INSERT of one row for every group of parameters values
+        '''
+        row = self.command[2]
+        if self.parameters == 0:
+            return self.command[:]
+        rows = []
+        for start in range(0, len(values), self.parameters):
+            group = iter(values[start:start + self.parameters])
+            rows.append([next(group) if value == PARAMETER else value for value in row])
+        return self.command[:2] + rows
+
+    def bind_conditions(self, values: list) -> dict:
+        conditions = {column: [list(cond) for cond in conds]
+                      for column, conds in (self.parsed[2] or {}).items()}
+        for (column, number), value in zip(self.slots, values):
+            conditions[column][number][1] = value
+        return conditions
@@ -0,0 +1,196 @@
+'''
+    Framed client/server protocol
+
+    A client opens the connection with MAGIC and the protocol version,
+    after that both sides exchange frames:
+        payload length (4 bytes), request id (4 bytes), kind (1 byte), payload
+    The client can send many commands without waiting for the answers,
+    the server answers them in order, tagged with the id of the request
+
+    The result of a SELECT is streamed: a COLUMNS frame, ROWS frames with
+    at most fetch size rows each, then the MESSAGE closing the request
+
+    Version 1 sends the commands as text and the rows as JSON lists of
+    strings, version 2 adds BINARY_COMMAND and sends the rows, the columns
+    and the progress in the typed binary encoding of the wire module
+'''
+
+import json
+import socket
+import struct
+from enum import IntEnum
+
+import wire
+from type_def import Types
+
+MAGIC = b"ABKR"
+VERSION = 2
+HEADER = struct.Struct("!IIB")
+
+
+class Kind(IntEnum):
+
+    # client -> server
+    COMMAND = 1
+    FETCH_SIZE = 3
+    INSERT = 6
+    BINARY_COMMAND = 8
+
+    # server -> client
+    MESSAGE = 2
+    COLUMNS = 4
+    ROWS = 5
+    PROGRESS = 7
+
+
+def recv_exact(s: socket.socket, size: int) -> bytes | None:
+    '''
+        Reads exactly size bytes, None if the connection was closed
+    '''
+    buffer = bytearray()
+    while len(buffer) < size:
+        chunk = s.recv(size - len(buffer))
+        if not chunk:
+            return None
+        buffer += chunk
+    return bytes(buffer)
+
+
+def send_frame(s: socket.socket, request_id: int, kind: Kind, payload: bytes):
+    s.sendall(HEADER.pack(len(payload), request_id, kind) + payload)
+
+
+def encode_rows(rows: list) -> bytes:
+    return json.dumps(rows).encode()
+
+
+def decode_rows(payload: bytes) -> list:
+    return json.loads(payload)
+
+
+def recv_frame(s: socket.socket) -> tuple | None:
+    '''
+        Returns (request id, kind, payload), None if the connection was closed
+        an unknown kind is returned as an int, for the receiver to reject it
+    '''
+    header = recv_exact(s, HEADER.size)
+    if header is None:
+        return None
+    length, request_id, kind = HEADER.unpack(header)
+    payload = recv_exact(s, length)
+    if payload is None:
+        return None
+    try:
+        kind = Kind(kind)
+    except ValueError:
+        pass
+    return request_id, kind, payload
+
+
+def handshake(s: socket.socket) -> int:
+    '''
+        Returns the protocol version of the client, 0 for clients of the
+        old protocol, which send the command right away without MAGIC
+    '''
+    start = s.recv(len(MAGIC), socket.MSG_PEEK)
+    if start and len(start) < len(MAGIC) and MAGIC.startswith(start):
+        # the rest of MAGIC didn't arrive yet, the peek blocks until it
+        # does or the connection is closed instead of being retried
+        timeout = s.gettimeout()
+        s.settimeout(None)
+        try:
+            start = s.recv(len(MAGIC), socket.MSG_PEEK | socket.MSG_WAITALL)
+        finally:
+            s.settimeout(timeout)
+    if start != MAGIC:
+        return 0
+
+    hello = recv_exact(s, len(MAGIC) + 1)
+    if hello is None:
+        return 0
+    return hello[-1]
+
+
+class Connection:
+    '''
+        Long lived client connection
+    '''
+
+    def __init__(self, host: str, port: int, version: int = VERSION):
+        self.s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)  # TCP socket
+        self.s.connect((host, port))
+        self.s.sendall(MAGIC + bytes([version]))
+        self.version = version
+        self.__next_id = 0
+
+    def send(self, command: str | list) -> int:
+        '''
+            Sends a command without waiting for the answer
+            a list (keywords as Types, values as they are) is sent in the
+            binary encoding, it needs version 2
+            returns the id of the request
+        '''
+        self.__next_id += 1
+        if isinstance(command, list):
+            send_frame(self.s, self.__next_id, Kind.BINARY_COMMAND, wire.encode(command))
+        else:
+            send_frame(self.s, self.__next_id, Kind.COMMAND, command.encode())
+        return self.__next_id
+
+    def recv(self) -> tuple:
+        '''
+            Returns the next (request id, kind, payload) sent by the server
+        '''
+        frame = recv_frame(self.s)
+        if frame is None:
+            raise ConnectionError("Connection to the server lost.")
+        return frame
+
+    def set_fetch_size(self, fetch_size: int):
+        '''
+            Maximum number of rows the server sends in one frame
+        '''
+        self.__next_id += 1
+        send_frame(self.s, self.__next_id, Kind.FETCH_SIZE,
+                   struct.pack("!I", fetch_size))
+
+    def insert_many(self, table: str, rows: list) -> int:
+        '''
+            Parameterized INSERT of many rows, the values are not parsed
+            as text, so they can contain spaces
+            with version 2 they are sent typed: dates as date, datetimes as
+            datetime
+            returns the id of the request
+        '''
+        if self.version >= 2:
+            return self.send([Types.INSERT, table] + [list(row) for row in rows])
+        self.__next_id += 1
+        send_frame(self.s, self.__next_id, Kind.INSERT,
+                   encode_rows({"table": table, "rows": rows}))
+        return self.__next_id
+
+    def result(self, request_id: int, on_rows=None) -> str:
+        '''
+            Waits for the answer of a request
+            the answers come in the order the requests were sent
+            on_rows(kind, data) is called with the columns and every batch
+            of rows streamed for the request, and with the PROGRESS
+            [done, total] of long commands
+        '''
+        while True:
+            answer_id, kind, payload = self.recv()
+            if answer_id != request_id:
+                continue
+            if kind == Kind.MESSAGE:
+                return payload.decode()
+            if on_rows is not None:
+                if self.version >= 2:
+                    on_rows(kind, wire.decode(payload))
+                else:
+                    on_rows(kind, decode_rows(payload))
+
+    def execute(self, command: str | list, on_rows=None) -> str:
+        return self.result(self.send(command), on_rows)
+
+    def close(self):
+        self.s.close()
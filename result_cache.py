@@ -0,0 +1,98 @@
+'''
+    Cache of the results of the SELECT commands
+    every table has a version, changed by every command writing into it or
+    changing its structure, a cached result is only used while the versions
+    of the tables it was read from are the same
+'''
+
+import itertools
+import threading
+from collections import OrderedDict
+
+MAX_ROWS = 100000
+MAX_RESULT_ROWS = 10000
+
+
+class ResultCache:
+    '''
+        (db, command) -> (versions of the tables, columns, rows, types),
+        LRU bounded by the total number of cached rows, bigger results
+        are not cached
+        the rows are kept typed, types are their column types
+        hits and misses count the SELECTs answered or not from the cache,
+        EXPLAIN shows them
+    '''
+
+    def __init__(self, max_rows: int = MAX_ROWS, max_result_rows: int = MAX_RESULT_ROWS):
+        self.max_rows = max_rows
+        self.max_result_rows = max_result_rows
+        self.hits = 0
+        self.misses = 0
+        self.__entries = OrderedDict()
+        self.__rows = 0
+        self.__versions = {}
+        # versions are never reused, not even after a database is dropped
+        self.__counter = itertools.count(1)
+        self.__lock = threading.Lock()
+
+    def versions(self, db: str, tables: list) -> tuple:
+        with self.__lock:
+            return tuple(self.__versions.get((db, table), 0) for table in tables)
+
+    def bump(self, db: str, table: str):
+        with self.__lock:
+            self.__versions[(db, table)] = next(self.__counter)
+
+    def drop_database(self, db: str):
+        with self.__lock:
+            for key in [key for key in self.__versions if key[0] == db]:
+                self.__versions[key] = next(self.__counter)
+            for key in [key for key in self.__entries if key[0] == db]:
+                self.__rows -= len(self.__entries.pop(key)[2])
+
+    def get(self, key: tuple, versions: tuple) -> tuple | None:
+        '''
+            The columns, the rows and the column types of the result,
+            if it is still valid
+        '''
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is None or entry[0] != versions:
+                self.misses += 1
+                return None
+            self.__entries.move_to_end(key)
+            self.hits += 1
+            return entry[1], entry[2], entry[3]
+
+    def cached(self, key: tuple, versions: tuple) -> bool:
+        '''
+            True if get would answer, the counters don't change
+        '''
+        with self.__lock:
+            entry = self.__entries.get(key)
+            return entry is not None and entry[0] == versions
+
+    def collect(self, key: tuple, versions: tuple, columns: list, rows, types: list = None):
+        '''
+            Generator of the rows, they are cached once all of them were read
+        '''
+        result = []
+        for row in rows:
+            if result is not None:
+                result.append(row)
+                if len(result) > self.max_result_rows:
+                    result = None
+            yield row
+        if result is not None:
+            self.__put(key, versions, columns, result, types)
+
+    def __put(self, key: tuple, versions: tuple, columns: list, rows: list, types: list):
+        with self.__lock:
+            old = self.__entries.pop(key, None)
+            if old is not None:
+                self.__rows -= len(old[2])
+            self.__entries[key] = (versions, columns, rows, types)
+            self.__rows += len(rows)
+            while self.__rows > self.max_rows and self.__entries:
+                _, (_, _, evicted, _) = self.__entries.popitem(last=False)
+                self.__rows -= len(evicted)
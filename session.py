@@ -0,0 +1,107 @@
+'''
+    Per connection state and locking for the concurrent server
+'''
+
+import threading
+from contextlib import contextmanager
+
+import protocol
+import wire
+from protocol import Kind
+
+FETCH_SIZE = 1000
+
+
+class Session:
+    '''
+        State of one client connection
+    '''
+
+    def __init__(self, client_s=None, framed: bool = False, binary: bool = False):
+        self.client_s = client_s
+        self.framed = framed
+        # the client speaks version 2, the rows are sent typed
+        self.binary = binary
+        self.request_id = 0
+        self.fetch_size = FETCH_SIZE
+        self.current_db = None
+        self.db = None
+        self.send_done = True
+        # explain.Trace of the EXPLAIN being executed
+        self.trace = None
+        # (key, versions) of the SELECT whose result is being cached
+        self.result = None
+        # name -> prepared.Prepared
+        self.prepared = {}
+
+    def send(self, string: str):
+        '''
+            Answers the request that is being executed
+        '''
+        if self.client_s is None:
+            return
+        if self.framed:
+            self.send_frame(Kind.MESSAGE, string.encode())
+        else:
+            self.client_s.sendall(string.encode())
+
+    def progress(self, done: int, total: int):
+        '''
+            Progress of a long command, only framed clients get it,
+            the old protocol has a single answer
+        '''
+        if self.client_s is None or not self.framed:
+            return
+        self.send_frame(Kind.PROGRESS, self.encode([done, total]))
+
+    def encode(self, data: list, types: list = None) -> bytes:
+        '''
+            Payload of a COLUMNS, ROWS or PROGRESS frame
+            types are the column types of the values of the rows
+        '''
+        if self.binary:
+            if types is None:
+                return wire.encode(data)
+            return wire.encode_rows(data, types)
+        return protocol.encode_rows(data)
+
+    def send_frame(self, kind: Kind, payload: bytes):
+        protocol.send_frame(self.client_s, self.request_id, kind, payload)
+
+
+class SessionLocal(threading.local):
+    '''
+        The session served by the current worker thread
+    '''
+
+    def __init__(self):
+        super().__init__()
+        self.session = Session()
+
+
+class LockManager:
+    '''
+        schema is held by commands changing the structure of the databases
+        table locks are held by the commands writing into the tables,
+        they are always taken in sorted order, so two commands can't deadlock
+    '''
+
+    def __init__(self):
+        self.schema = threading.RLock()
+        self.__tables = {}
+        self.__guard = threading.Lock()
+
+    def __table_lock(self, db: str, table: str) -> threading.RLock:
+        with self.__guard:
+            return self.__tables.setdefault((db, table), threading.RLock())
+
+    @contextmanager
+    def tables(self, db: str, tables: list):
+        locks = [self.__table_lock(db, table) for table in sorted(set(tables))]
+        for lock in locks:
+            lock.acquire()
+        try:
+            yield
+        finally:
+            for lock in reversed(locks):
+                lock.release()
@@ -0,0 +1,323 @@
+'''
+    Statistics of the tables, collected by ANALYZE
+    they are kept in <db>/<table>.stats.json next to the schema
+'''
+
+import hashlib
+import json
+import math
+import os
+import random
+import threading
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+
+import datatypes
+from type_def import Types
+
+HLL_PRECISION = 12
+BUCKETS = 32
+SAMPLE_SIZE = 10000
+BATCH_SIZE = 1000
+
+# analyzed tables are analyzed again after this many written rows
+AUTO_ANALYZE = 10000
+
+
+class HyperLogLog:
+    '''
+        Estimates the number of distinct values in a fixed 2^precision bytes
+    '''
+
+    def __init__(self, precision: int = HLL_PRECISION):
+        self.precision = precision
+        self.size = 1 << precision
+        self.registers = bytearray(self.size)
+
+    def add(self, value):
+        digest = hashlib.blake2b(repr(value).encode(), digest_size=8).digest()
+        hashed = int.from_bytes(digest, "big")
+        register = hashed >> (64 - self.precision)
+        rest = hashed & ((1 << (64 - self.precision)) - 1)
+        rank = 64 - self.precision - rest.bit_length() + 1
+        if rank > self.registers[register]:
+            self.registers[register] = rank
+
+    def count(self) -> int:
+        alpha = 0.7213 / (1 + 1.079 / self.size)
+        estimate = alpha * self.size * self.size / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        # small cardinalities are counted better by the empty registers
+        if estimate <= 2.5 * self.size and zeros:
+            estimate = self.size * math.log(self.size / zeros)
+        return round(estimate)
+
+
+def equi_depth(pairs, total: int, buckets: int = BUCKETS) -> list:
+    '''
+        Upper bounds of the buckets holding the same number of rows,
+        pairs are (value, number of rows) in the order of the values
+    '''
+    if total == 0:
+        return []
+    bounds = []
+    seen = 0
+    for value, count in pairs:
+        seen += count
+        while len(bounds) < buckets and seen >= (len(bounds) + 1) * total / buckets:
+            bounds.append(value)
+    return bounds
+
+
+class ColumnStats:
+
+    __slots__ = ('distinct', 'nulls', 'min', 'max', 'bounds')
+
+    def __init__(self, distinct: int, nulls: int, min, max, bounds: list):
+        self.distinct = distinct
+        self.nulls = nulls
+        self.min = min
+        self.max = max
+        self.bounds = bounds
+
+    def selectivity(self, conditions: list) -> float:
+        '''
+            Estimated fraction of the rows matching all the
+            (operator, typed value) conditions
+        '''
+        low, high = 0.0, 1.0
+        equal = 1.0
+        for operator, value in conditions:
+            match operator:
+                case Types.EQ:
+                    equal *= self.__equal(value)
+                case Types.NE:
+                    equal *= 1 - self.__equal(value)
+                case Types.LT:
+                    high = min(high, self.__below(value, False))
+                case Types.LE:
+                    high = min(high, self.__below(value, True))
+                case Types.GT:
+                    low = max(low, self.__below(value, True))
+                case Types.GE:
+                    low = max(low, self.__below(value, False))
+        return max(high - low, 0.0) * equal
+
+    def __equal(self, value) -> float:
+        if self.min is None or value < self.min or value > self.max:
+            return 0.0
+        # a frequent value is the bound of several buckets
+        buckets = bisect_right(self.bounds, value) - bisect_left(self.bounds, value)
+        if buckets > 1:
+            return buckets / len(self.bounds)
+        return 1 / max(self.distinct, 1)
+
+    def __below(self, value, inclusive: bool) -> float:
+        '''
+            Fraction of the rows smaller than (or equal to) the value
+        '''
+        if self.min is None or value < self.min:
+            return 0.0
+        if value > self.max or (inclusive and value == self.max):
+            return 1.0
+        if not self.bounds:
+            return 0.5
+
+        if inclusive:
+            bucket = bisect_right(self.bounds, value)
+        else:
+            bucket = bisect_left(self.bounds, value)
+        if bucket == len(self.bounds):
+            return 1.0
+        lower = self.min if bucket == 0 else self.bounds[bucket - 1]
+        upper = self.bounds[bucket]
+        return (bucket + _position(lower, upper, value)) / len(self.bounds)
+
+
+def _position(lower, upper, value) -> float:
+    '''
+        Where the value is between the bounds of its bucket, from 0 to 1
+    '''
+    if isinstance(value, datetime):
+        lower, upper, value = lower.timestamp(), upper.timestamp(), value.timestamp()
+    if not isinstance(value, (int, float)) or upper <= lower:
+        return 0.5
+    return min(max((value - lower) / (upper - lower), 0.0), 1.0)
+
+
+class TableStats:
+
+    __slots__ = ('rows', 'columns')
+
+    def __init__(self, rows: int, columns: dict):
+        self.rows = rows
+        self.columns = columns
+
+    def to_json(self, schema) -> dict:
+        def text(value, type):
+            return None if value is None else datatypes.to_string(value, type)
+
+        columns = {}
+        for column in schema.columns:
+            stats = self.columns[column.name]
+            columns[column.name] = {
+                "distinct": stats.distinct,
+                "nulls": stats.nulls,
+                "min": text(stats.min, column.type),
+                "max": text(stats.max, column.type),
+                "histogram": [text(bound, column.type) for bound in stats.bounds],
+            }
+        return {"rows": self.rows, "columns": columns}
+
+    @staticmethod
+    def from_json(schema, data: dict):
+        def typed(value, type):
+            return None if value is None else datatypes.convert(value, type)
+
+        columns = {}
+        for column in schema.columns:
+            stats = data["columns"].get(column.name)
+            if stats is None:
+                continue
+            columns[column.name] = ColumnStats(
+                stats["distinct"], stats["nulls"],
+                typed(stats["min"], column.type), typed(stats["max"], column.type),
+                [typed(bound, column.type) for bound in stats["histogram"]])
+        return TableStats(data["rows"], columns)
+
+
+def index_table_postings(index_table) -> list:
+    '''
+        (value, number of ids) of an index table, in the order of the values
+    '''
+    # only the number of ids of the values is sent back
+    return [(val["_id"], val["count"]) for val in index_table.aggregate(
+        [{"$project": {"count": {"$size": "$Value"}}}, {"$sort": {"_id": 1}}])]
+
+
+def analyze(schema, table, index_postings: dict) -> TableStats:
+    '''
+        One streaming pass over the table, the indexed columns are read from
+        their indexes (index_postings maps them to the (value, number of ids)
+        pairs), in the order of the values, so their histograms are exact
+        the histograms of the other columns are built from a sample
+    '''
+    scanned = [column for column in schema.columns if column.name not in index_postings]
+    hlls = {column.name: HyperLogLog() for column in scanned}
+    samples = {column.name: [] for column in scanned}
+    nulls = {column.name: 0 for column in scanned}
+    lows = {}
+    highs = {}
+    sampler = random.Random(0)
+
+    rows = 0
+    projection = {"Value": 1} if not schema.typed else {column.name: 1 for column in scanned}
+    for document in table.find({}, projection, batch_size=BATCH_SIZE):
+        row = datatypes.row(schema, document)
+        rows += 1
+        slot = sampler.randrange(rows) if rows > SAMPLE_SIZE else None
+        for column in scanned:
+            value = row.get(schema.field(column.name))
+            if value is None:
+                nulls[column.name] += 1
+                continue
+            hlls[column.name].add(value)
+            if column.name not in lows or value < lows[column.name]:
+                lows[column.name] = value
+            if column.name not in highs or value > highs[column.name]:
+                highs[column.name] = value
+            # reservoir sample of the values
+            sample = samples[column.name]
+            if len(sample) < SAMPLE_SIZE:
+                sample.append(value)
+            elif slot < SAMPLE_SIZE:
+                sample[slot] = value
+
+    columns = {}
+    for column in scanned:
+        sample = sorted(samples[column.name])
+        distinct = rows if column.position == 1 else min(hlls[column.name].count(), rows)
+        columns[column.name] = ColumnStats(
+            distinct, nulls[column.name], lows.get(column.name), highs.get(column.name),
+            equi_depth(((value, 1) for value in sample), len(sample)))
+
+    for name, postings in index_postings.items():
+        postings = list(postings)
+        indexed = sum(count for _, count in postings)
+        columns[name] = ColumnStats(
+            len(postings), max(rows - indexed, 0),
+            postings[0][0] if postings else None, postings[-1][0] if postings else None,
+            equi_depth(postings, indexed))
+
+    return TableStats(rows, columns)
+
+
+class StatsStore:
+    '''
+        The statistics of the tables, read from their files when first used
+        also counts the rows written since a table was analyzed
+    '''
+
+    def __init__(self):
+        self.__tables = {}
+        self.__writes = {}
+        self.__lock = threading.Lock()
+
+    @staticmethod
+    def path(db: str, table: str) -> str:
+        return db + '/' + table + '.stats.json'
+
+    def get(self, db: str, schema) -> TableStats | None:
+        key = (db, schema.name)
+        with self.__lock:
+            if key in self.__tables:
+                return self.__tables[key]
+        path = self.path(db, schema.name)
+        stats = None
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                stats = TableStats.from_json(schema, json.load(f))
+        with self.__lock:
+            self.__tables[key] = stats
+        return stats
+
+    def save(self, db: str, schema, stats: TableStats):
+        with self.__lock:
+            with open(self.path(db, schema.name), "w", encoding="utf-8") as f:
+                json.dump(stats.to_json(schema), f, indent=4)
+            self.__tables[(db, schema.name)] = stats
+            self.__writes[(db, schema.name)] = 0
+
+    def written(self, db: str, table: str, rows: int) -> bool:
+        '''
+            Counts the written rows, True if an analyzed table
+            has to be analyzed again
+        '''
+        key = (db, table)
+        with self.__lock:
+            if key in self.__tables:
+                analyzed = self.__tables[key] is not None
+            else:
+                analyzed = os.path.exists(self.path(db, table))
+            if not analyzed:
+                return False
+            self.__writes[key] = self.__writes.get(key, 0) + rows
+            if self.__writes[key] < AUTO_ANALYZE:
+                return False
+            self.__writes[key] = 0
+            return True
+
+    def drop(self, db: str, table: str):
+        with self.__lock:
+            self.__tables.pop((db, table), None)
+            self.__writes.pop((db, table), None)
+            path = self.path(db, table)
+            if os.path.exists(path):
+                os.remove(path)
+
+    def drop_database(self, db: str):
+        with self.__lock:
+            for key in [key for key in self.__tables if key[0] == db]:
+                del self.__tables[key]
+            for key in [key for key in self.__writes if key[0] == db]:
+                del self.__writes[key]
@@ -46,3 +46,12 @@ class Types(IntEnum):
     DATE = auto()
     DATETIME = auto()
     STRING = auto()
+
+    # COMMANDS added later, appended so the codes sent over the network
+    # by older clients stay the same
+    MIGRATE = auto()
+    ROW = auto()
+    ANALYZE = auto()
+    EXPLAIN = auto()
+    PREPARE = auto()
+    EXECUTE = auto()
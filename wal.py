@@ -0,0 +1,224 @@
+'''
+    Write-ahead log of the inserts and deletes
+    The record of an operation (the rows, the index updates follow from them
+    and from the schema) is synced to the log before any of its writes is
+    done. The writers waiting for a sync share it: one of them syncs every
+    record written until then (group commit).
+    A done operation gets a COMMIT marker, it's written by the next sync,
+    after the storage is synced, so a committed operation is never redone.
+    A failed operation gets an ABORT marker before its writes are undone.
+    The recovery at startup redoes the operations without a COMMIT marker,
+    they are the last ones of their tables (a table is locked while it's
+    written), and undoes the aborted ones. Redo and undo are idempotent,
+    so it doesn't matter how much of the operation was done.
+    A checkpoint syncs the storage, then rewrites the log with the records
+    of the operations still running.
+'''
+
+import os
+import threading
+from contextlib import contextmanager
+
+import wire
+
+WAL_PATH = os.getenv('ABKR_WAL', default="abkr.wal")
+
+# size of the log starting a checkpoint
+CHECKPOINT_SIZE = 16 * 1024 * 1024
+
+INSERT = 1
+DELETE = 2
+COMMIT = 3
+ABORT = 4
+
+
+def values(schema, documents: list) -> list:
+    '''
+        The values of the typed rows, in the order of the columns
+    '''
+    return [[document["_id"]] + [document[column.name] for column in schema.columns[1:]]
+            for document in documents]
+
+
+def inverse(record: list) -> list:
+    '''
+        The operation undoing the insert or the delete of the record
+    '''
+    operation, db, table, rows = record
+    return [DELETE if operation == INSERT else INSERT, db, table, rows]
+
+
+def document(schema, row: list) -> dict:
+    typed = {"_id": row[0]}
+    for column, value in zip(schema.columns[1:], row[1:]):
+        typed[column.name] = value
+    return typed
+
+
+class WriteAheadLog:
+
+    def __init__(self, sync_storage, apply, path: str = WAL_PATH):
+        '''
+            sync_storage() makes the writes done until then durable,
+            apply(record) redoes the operation of a record
+        '''
+        self.path = path
+        self.syncs = 0
+        self.__sync_storage = sync_storage
+        self.__apply = apply
+        self.__file = None
+        self.__size = 0
+        # sequence numbers of the last written and the last synced record
+        self.__written = 0
+        self.__synced = 0
+        self.__syncing = False
+        # sequence -> encoded record of the operations not done yet
+        self.__running = {}
+        # COMMIT markers of the operations done since the last sync
+        self.__commits = []
+        self.__lock = threading.Lock()
+        self.__sync_done = threading.Condition()
+
+    def records(self):
+        '''
+            The operations to apply at startup: the ones without a COMMIT
+            marker, the inverse of the aborted ones, in the order of the log.
+            A record cut by a crash is dropped
+        '''
+        operations = {}
+        aborted = set()
+        for record in wire.records(self.path):
+            sequence, kind = record[:2]
+            if kind == COMMIT:
+                operations.pop(sequence, None)
+            elif kind == ABORT:
+                aborted.add(sequence)
+            else:
+                operations[sequence] = record[1:]
+        for sequence, record in operations.items():
+            yield inverse(record) if sequence in aborted else record
+
+    @contextmanager
+    def operation(self, record: list):
+        '''
+            record is [INSERT or DELETE, db, table, values of the rows],
+            it is durable when the body runs. The writes of a failed
+            body are undone
+        '''
+        sequence = self.__log(record, None)
+        try:
+            yield
+        except BaseException:
+            self.__log([ABORT], sequence)
+            try:
+                self.__apply(inverse(record))
+            except Exception as e:
+                # the record and its ABORT marker stay, the recovery undoes it
+                print("Error: undo of a failed operation failed: " + str(e))
+            else:
+                self.__done(sequence)
+            raise
+        self.__done(sequence)
+
+    def __log(self, record: list, sequence: int | None) -> int:
+        '''
+            Writes and syncs the record of a new operation (sequence is None)
+            or a marker of a running one
+        '''
+        with self.__lock:
+            if self.__file is None:
+                self.__file = open(self.path, "ab")
+                self.__size = self.__file.tell()
+            if sequence is None:
+                self.__written += 1
+                sequence = self.__written
+                data = wire.record([sequence] + record)
+                self.__running[sequence] = data
+            else:
+                data = wire.record([sequence] + record)
+                # a checkpoint keeps the marker with the record
+                self.__running[sequence] += data
+                self.__written += 1
+            self.__file.write(data)
+            self.__size += len(data)
+            written = self.__written
+        self.__sync(written)
+        return sequence
+
+    def __sync(self, sequence: int):
+        '''
+            Waits until the record is synced, the first waiting writer
+            syncs the records of the others too
+        '''
+        with self.__sync_done:
+            while self.__synced < sequence:
+                if self.__syncing:
+                    self.__sync_done.wait()
+                    continue
+                self.__syncing = True
+                self.__sync_done.release()
+                synced = 0
+                try:
+                    with self.__lock:
+                        commits = self.__commits
+                        self.__commits = []
+                    if commits:
+                        # the writes of the committed operations are durable
+                        # before their markers are written
+                        try:
+                            self.__sync_storage()
+                        except BaseException:
+                            with self.__lock:
+                                self.__commits = commits + self.__commits
+                            raise
+                    with self.__lock:
+                        self.__file.write(b"".join(commits))
+                        self.__size += sum(len(commit) for commit in commits)
+                        self.__file.flush()
+                        written = self.__written
+                        fileno = self.__file.fileno()
+                    os.fsync(fileno)
+                    synced = written
+                finally:
+                    self.__sync_done.acquire()
+                    self.__synced = max(self.__synced, synced)
+                    self.__syncing = False
+                    self.__sync_done.notify_all()
+                self.syncs += 1
+
+    def __done(self, sequence: int):
+        with self.__lock:
+            del self.__running[sequence]
+            self.__commits.append(wire.record([sequence, COMMIT]))
+            full = self.__size > CHECKPOINT_SIZE
+        if full:
+            self.checkpoint()
+
+    def checkpoint(self):
+        with self.__sync_done:
+            while self.__syncing:
+                self.__sync_done.wait()
+            with self.__lock:
+                self.__sync_storage()
+                temporary = self.path + ".tmp"
+                with open(temporary, "wb") as f:
+                    f.write(b"".join(self.__running.values()))
+                    f.flush()
+                    os.fsync(f.fileno())
+                if self.__file is not None:
+                    self.__file.close()
+                os.replace(temporary, self.path)
+                self.__file = open(self.path, "ab")
+                self.__size = self.__file.tell()
+                self.__synced = self.__written
+                self.__commits = []
+
+    def close(self):
+        '''
+            Checkpoints, the operations done are not redone at the next start
+        '''
+        self.checkpoint()
+        with self.__lock:
+            if self.__file is not None:
+                self.__file.close()
+                self.__file = None
@@ -0,0 +1,214 @@
+'''
+    Binary encoding of the commands and of the result rows,
+    used by the clients of protocol version 2
+
+    Every value starts with a tag byte:
+        NULL
+        KEYWORD   the code of a Types keyword (1 byte)
+        STRING    length (4 bytes) and UTF-8 text
+        INT       8 bytes
+        FLOAT     8 bytes, IEEE 754
+        BIT       1 byte
+        DATE      days since 0001-01-01 (4 bytes)
+        DATETIME  seconds since 0001-01-01 (8 bytes)
+        LIST      number of items (4 bytes), then the items
+    A command is a LIST of keywords, names and values, the rows of an INSERT
+    and the statement of a PREPARE are nested LISTs, so nothing has to be
+    guessed from the text and the values can contain spaces and "#"
+    A batch of result rows is a LIST of LISTs
+'''
+
+import os
+import struct
+from datetime import date, datetime, timedelta
+from enum import IntEnum
+
+import datatypes
+from type_def import Types
+
+EPOCH = datetime(1, 1, 1)
+
+BYTE = struct.Struct("!B")
+LENGTH = struct.Struct("!I")
+INT = struct.Struct("!q")
+FLOAT = struct.Struct("!d")
+DAYS = struct.Struct("!i")
+
+
+class Tag(IntEnum):
+
+    NULL = 0
+    KEYWORD = 1
+    STRING = 2
+    INT = 3
+    FLOAT = 4
+    BIT = 5
+    DATE = 6
+    DATETIME = 7
+    LIST = 8
+
+
+def encode(value, type: str = None) -> bytes:
+    '''
+        type is the column type of the value, it tells a bit from an int
+        and a date from a datetime (both are stored as datetimes)
+    '''
+    out = bytearray()
+    _write(out, value, type)
+    return bytes(out)
+
+
+def encode_rows(rows: list, types: list = None) -> bytes:
+    '''
+        types are the column types of the values of every row
+    '''
+    out = bytearray()
+    out += BYTE.pack(Tag.LIST) + LENGTH.pack(len(rows))
+    for row in rows:
+        out += BYTE.pack(Tag.LIST) + LENGTH.pack(len(row))
+        if types is None:
+            for value in row:
+                _write(out, value, None)
+        else:
+            for value, type in zip(row, types):
+                _write(out, value, type)
+    return bytes(out)
+
+
+def _write(out: bytearray, value, type: str | None):
+    if value is None:
+        out += BYTE.pack(Tag.NULL)
+    elif isinstance(value, Types):
+        out += BYTE.pack(Tag.KEYWORD) + BYTE.pack(value.value)
+    elif isinstance(value, str):
+        data = value.encode()
+        out += BYTE.pack(Tag.STRING) + LENGTH.pack(len(data)) + data
+    elif isinstance(value, bool) or type == 'bit':
+        out += BYTE.pack(Tag.BIT) + BYTE.pack(int(value))
+    elif isinstance(value, int):
+        out += BYTE.pack(Tag.INT) + INT.pack(value)
+    elif isinstance(value, float):
+        out += BYTE.pack(Tag.FLOAT) + FLOAT.pack(value)
+    elif isinstance(value, datetime) and type != 'date':
+        out += BYTE.pack(Tag.DATETIME) + INT.pack((value - EPOCH) // timedelta(seconds=1))
+    elif isinstance(value, date):
+        out += BYTE.pack(Tag.DATE) + DAYS.pack(value.toordinal() - 1)
+    elif isinstance(value, (list, tuple)):
+        out += BYTE.pack(Tag.LIST) + LENGTH.pack(len(value))
+        for item in value:
+            _write(out, item, None)
+    else:
+        raise ValueError("Can't encode " + repr(value))
+
+
+def decode(payload: bytes):
+    '''
+        Dates are decoded as dates, datetimes as datetimes
+    '''
+    value, end = _read(memoryview(payload), 0)
+    if end != len(payload):
+        raise ValueError("Unexpected data after the value")
+    return value
+
+
+def _read(data: memoryview, offset: int) -> tuple:
+    tag = data[offset]
+    offset += 1
+    match tag:
+        case Tag.NULL:
+            return None, offset
+        case Tag.KEYWORD:
+            return Types(data[offset]), offset + 1
+        case Tag.STRING:
+            length, = LENGTH.unpack_from(data, offset)
+            offset += LENGTH.size
+            return str(data[offset:offset + length], "utf-8"), offset + length
+        case Tag.INT:
+            return INT.unpack_from(data, offset)[0], offset + INT.size
+        case Tag.FLOAT:
+            return FLOAT.unpack_from(data, offset)[0], offset + FLOAT.size
+        case Tag.BIT:
+            return data[offset], offset + 1
+        case Tag.DATE:
+            days, = DAYS.unpack_from(data, offset)
+            return date.fromordinal(days + 1), offset + DAYS.size
+        case Tag.DATETIME:
+            seconds, = INT.unpack_from(data, offset)
+            return EPOCH + timedelta(seconds=seconds), offset + INT.size
+        case Tag.LIST:
+            length, = LENGTH.unpack_from(data, offset)
+            offset += LENGTH.size
+            items = []
+            for _ in range(length):
+                item, offset = _read(data, offset)
+                items.append(item)
+            return items, offset
+        case _:
+            raise ValueError("Unknown tag " + str(tag))
+
+
+def text(value) -> str:
+    '''
+        The value written the way the user types it
+    '''
+    if value is None:
+        return "null"
+    if isinstance(value, datetime):
+        return value.strftime(datatypes.DATETIME_FORMAT)
+    if isinstance(value, date):
+        return value.strftime(datatypes.DATE_FORMAT)
+    return str(value)
+
+
+def decode_command(payload: bytes) -> list:
+    '''
+        The command as the server runs it: keywords as Types, every other
+        value as text, it is checked against the column types like the
+        values typed by the user
+    '''
+    command = decode(payload)
+    if not isinstance(command, list) or not command:
+        raise ValueError("A command has to be a non empty list")
+
+    def convert(value):
+        if isinstance(value, Types):
+            return value
+        if isinstance(value, list):
+            return [convert(item) for item in value]
+        return text(value)
+
+    return [convert(value) for value in command]
+
+
+def record(value) -> bytes:
+    '''
+        A value of a log file, prefixed with its length
+    '''
+    data = encode(value)
+    return LENGTH.pack(len(data)) + data
+
+
+def records(path: str):
+    '''
+        The values of a log file, the file is cut after the last whole
+        record, a record cut by a crash is dropped
+    '''
+    if not os.path.exists(path):
+        return
+    with open(path, "rb") as f:
+        data = f.read()
+    offset = 0
+    while offset + LENGTH.size <= len(data):
+        length, = LENGTH.unpack_from(data, offset)
+        end = offset + LENGTH.size + length
+        if end > len(data):
+            break
+        try:
+            value = decode(data[offset + LENGTH.size:end])
+        except (ValueError, IndexError, struct.error):
+            break
+        offset = end
+        yield value
+    if offset != len(data):
+        with open(path, "r+b") as f:
+            f.truncate(offset)